@@ -1,4 +1,5 @@
 import logging
+import warnings
 from typing import List
 
 import numpy as np
@@ -11,7 +12,13 @@ from torchvision import transforms
 from torchvision.transforms import Compose
 from sklearn.preprocessing import OneHotEncoder
 
-from src.utils.basic.io import get_file_list
+from src.helper.cache import LRUTensorCache
+from src.utils.basic.io import (
+    get_file_list,
+    get_image_store,
+    load_image_store,
+    load_seq_data_and_labels,
+)
 
 
 class LabeledDataset(Dataset):
@@ -19,6 +26,27 @@ class LabeledDataset(Dataset):
         super(LabeledDataset, self).__init__()
         self.labels = None
         self.transformation_pipeline = None
+        self.paired_training_idc = None
+        self.paired_training_mask = None
+
+    def set_paired_training_idc(self, paired_training_idc: List[int] = None) -> None:
+        # Precompute a boolean mask once such that the lookup per sample is O(1).
+        self.paired_training_idc = paired_training_idc
+        if paired_training_idc is None:
+            self.paired_training_mask = None
+        else:
+            self.paired_training_mask = np.zeros(len(self), dtype=bool)
+            self.paired_training_mask[np.asarray(paired_training_idc, dtype=int)] = True
+
+    @property
+    def supports_batch_fetch(self) -> bool:
+        return hasattr(self, "get_batch")
+
+
+def is_batch_index(index) -> bool:
+    if isinstance(index, (list, tuple)):
+        return True
+    return isinstance(index, (np.ndarray, Tensor)) and index.ndim > 0
 
 
 class TorchNucleiImageDataset(LabeledDataset):
@@ -28,6 +56,8 @@ class TorchNucleiImageDataset(LabeledDataset):
         label_fname: str,
         transform_pipeline: Compose = None,
         paired_training_idc: List[int] = None,
+        use_image_store: bool = False,
+        cache_bytes: int = 0,
     ):
         super(TorchNucleiImageDataset, self).__init__()
 
@@ -37,14 +67,28 @@ class TorchNucleiImageDataset(LabeledDataset):
         self.labels = np.array(labels.loc[:, "binary_label"])
         self.image_locs = get_file_list(self.image_dir)
         self.transform_pipeline = transform_pipeline
-        self.paired_training_idc = paired_training_idc
+        self.set_paired_training_idc(paired_training_idc)
+
+        # Serve the decoded images from a packed N x 1 x H x W memory map instead of decoding the files every epoch.
+        self.use_image_store = use_image_store
+        if self.use_image_store:
+            self.images, _ = get_image_store(
+                image_dir=self.image_dir, image_locs=self.image_locs
+            )
+        else:
+            self.images = None
+
+        # Keep decoded images in an LRU cache that is shared by all subsets created from this dataset.
+        if cache_bytes > 0 and not self.use_image_store:
+            self.image_cache = LRUTensorCache(max_bytes=cache_bytes)
+        else:
+            self.image_cache = None
 
     def __len__(self) -> int:
         return len(self.image_locs)
 
     def __getitem__(self, index: int) -> dict:
-        img_loc = self.image_locs[index]
-        image = self.process_image(image_loc=img_loc)
+        image = self.get_image(index)
         if self.transform_pipeline is not None:
             image = self.transform_pipeline(image)
 
@@ -52,11 +96,8 @@ class TorchNucleiImageDataset(LabeledDataset):
         label = torch.from_numpy(label)
 
         sample = {"image": image, "label": label}
-        if self.paired_training_idc is not None:
-            if index in self.paired_training_idc:
-                sample["train_pair"] = torch.from_numpy(np.array(1))
-            else:
-                sample["train_pair"] = torch.from_numpy(np.array(0))
+        if self.paired_training_mask is not None:
+            sample["train_pair"] = torch.tensor(self.paired_training_mask[index])
         return sample
 
     def set_transform_pipeline(
@@ -64,12 +105,41 @@ class TorchNucleiImageDataset(LabeledDataset):
     ) -> None:
         self.transform_pipeline = transform_pipeline
 
+    def get_image(self, index: int) -> Tensor:
+        if self.images is not None:
+            return torch.from_numpy(np.array(self.images[index], dtype=np.float32))
+        if self.image_cache is None:
+            return self.process_image(image_loc=self.image_locs[index])
+
+        image = self.image_cache.get(index)
+        if image is None:
+            image = self.process_image(image_loc=self.image_locs[index])
+            self.image_cache.put(index, image)
+        # Hand out a copy such that in-place transforms can not corrupt the cached image.
+        return image.clone()
+
+    def get_cache_info(self) -> dict:
+        if self.image_cache is None:
+            return None
+        return self.image_cache.get_info()
+
     def process_image(self, image_loc: str) -> Tensor:
         image = io.imread(image_loc)
         image = np.array(image, dtype=np.float32)
         image = torch.from_numpy(image).unsqueeze(0)
         return image
 
+    def __getstate__(self) -> dict:
+        # Reopen the memory map in the data loader workers instead of pickling the packed images.
+        state = self.__dict__.copy()
+        state["images"] = None
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        if self.use_image_store:
+            self.images, _ = load_image_store(self.image_dir)
+
 
 class TorchSeqDataset(LabeledDataset):
     def __init__(
@@ -78,45 +148,126 @@ class TorchSeqDataset(LabeledDataset):
         transform_pipeline: Compose = None,
         sample_index: bool = True,
         paired_training_idc: List[int] = None,
+        use_cache: bool = True,
+        backing_store: str = "memory",
     ):
         super(TorchSeqDataset, self).__init__()
         self.seq_data_and_labels_fname = seq_data_and_labels_fname
-        seq_data_and_labels = pd.read_csv(self.seq_data_and_labels_fname, index_col=0)
+        self.use_cache = use_cache
+        self.backing_store = backing_store
+        seq_data, labels, sample_ids = load_seq_data_and_labels(
+            self.seq_data_and_labels_fname, use_cache=use_cache
+        )
 
         if sample_index:
-            self.sample_ids = list(seq_data_and_labels.index)
+            self.sample_ids = sample_ids.tolist()
         else:
             self.sample_ids = None
 
-        self.seq_data = np.array(seq_data_and_labels.iloc[:, :-1]).astype(np.float32)
+        # memory: private dense copy, mmap: read-only view of the binary cache that is shared via the page cache by
+        # all datasets and data loader workers, shared: dense copy in shared memory that is handed to the workers
+        # instead of being pickled.
+        if self.backing_store == "memory":
+            self.seq_data = np.array(seq_data, dtype=np.float32)
+            self.seq_data_tensor = torch.from_numpy(self.seq_data)
+        elif self.backing_store == "mmap":
+            if not isinstance(seq_data, np.memmap):
+                raise RuntimeError(
+                    "The mmap backing store requires the binary cache, set use_cache to"
+                    " True."
+                )
+            self.seq_data = seq_data
+            self.seq_data_tensor = self.get_read_only_tensor(self.seq_data)
+        elif self.backing_store == "shared":
+            self.seq_data_tensor = torch.from_numpy(
+                np.array(seq_data, dtype=np.float32)
+            ).share_memory_()
+            self.seq_data = self.seq_data_tensor.numpy()
+        else:
+            raise NotImplementedError(
+                'Unknown backing store "{}", expected one of the following: memory,'
+                " mmap, shared".format(self.backing_store)
+            )
 
-        self.labels = np.array(seq_data_and_labels.iloc[:, -1]).astype(int)
+        self.labels = np.array(labels).astype(int)
         self.transform_pipeline = transform_pipeline
 
-        self.paired_training_idc = paired_training_idc
+        self.set_paired_training_idc(paired_training_idc)
 
     def __len__(self) -> int:
         return len(self.labels)
 
     def __getitem__(self, index: int) -> dict:
-        seq_data = torch.from_numpy(self.seq_data[index])
+        if is_batch_index(index):
+            return self.get_batch(index)
+
+        seq_data = self.seq_data_tensor[index]
         label = torch.from_numpy(np.array(self.labels[index]))
         sample = {"seq_data": seq_data, "label": label}
         if self.sample_ids is not None:
             sample["id"] = self.sample_ids[index]
-        if self.paired_training_idc is not None:
-            if index in self.paired_training_idc:
-                sample["train_pair"] = torch.from_numpy(np.array(1))
-            else:
-                sample["train_pair"] = torch.from_numpy(np.array(0))
+        if self.paired_training_mask is not None:
+            sample["train_pair"] = torch.tensor(self.paired_training_mask[index])
 
         return sample
 
+    def get_batch(self, indices: List[int]) -> dict:
+        # Gathers a whole batch in one vectorized step instead of building and collating one dict per sample.
+        indices = np.asarray(indices, dtype=np.int64)
+        seq_data = self.seq_data_tensor[torch.from_numpy(indices)]
+        labels = torch.from_numpy(self.labels[indices])
+        batch = {"seq_data": seq_data, "label": labels}
+        if self.sample_ids is not None:
+            batch["id"] = [self.sample_ids[i] for i in indices]
+        if self.paired_training_mask is not None:
+            batch["train_pair"] = torch.from_numpy(self.paired_training_mask[indices])
+        return batch
+
+    def __getstate__(self) -> dict:
+        # Avoid pickling the matrix when the dataset is sent to the data loader workers: the memory map is reopened
+        # and the shared memory tensor is transferred by handle via the torch multiprocessing reductions.
+        state = self.__dict__.copy()
+        if self.backing_store == "memory":
+            state["seq_data_tensor"] = None
+        elif self.backing_store == "mmap":
+            state["seq_data"] = None
+            state["seq_data_tensor"] = None
+        elif self.backing_store == "shared":
+            state["seq_data"] = None
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        if self.backing_store == "memory":
+            self.seq_data_tensor = torch.from_numpy(self.seq_data)
+        elif self.backing_store == "mmap":
+            self.seq_data, _, _ = load_seq_data_and_labels(
+                self.seq_data_and_labels_fname, use_cache=True
+            )
+            self.seq_data_tensor = self.get_read_only_tensor(self.seq_data)
+        elif self.backing_store == "shared":
+            self.seq_data = self.seq_data_tensor.numpy()
+
+    @staticmethod
+    def get_read_only_tensor(array: np.ndarray) -> Tensor:
+        # torch warns about non-writable arrays, the returned views must not be modified in-place.
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)
+            return torch.from_numpy(array)
+
 
 class TorchTransformableSubset(Subset):
     def __init__(self, dataset: LabeledDataset, indices):
         super().__init__(dataset=dataset, indices=indices)
 
+    @property
+    def supports_batch_fetch(self) -> bool:
+        return self.dataset.supports_batch_fetch
+
+    def get_batch(self, indices: List[int]) -> dict:
+        indices = np.asarray(self.indices)[np.asarray(indices, dtype=np.int64)]
+        return self.dataset.get_batch(indices)
+
     def set_transform_pipeline(self, transform_pipeline: transforms.Compose) -> None:
         try:
             self.dataset.set_transform_pipeline(transform_pipeline)
@@ -126,3 +277,36 @@ class TorchTransformableSubset(Subset):
                 "set_transform_pipeline method."
             )
             raise exception
+
+
+class PairedDataset(Dataset):
+    def __init__(self, datasets: List[Dataset]):
+        super().__init__()
+        if len(set([len(dataset) for dataset in datasets])) != 1:
+            raise RuntimeError(
+                "Paired datasets must match in the samples-dimension, got sizes {}.".format(
+                    [len(dataset) for dataset in datasets]
+                )
+            )
+        self.datasets = datasets
+
+    def __len__(self) -> int:
+        return len(self.datasets[0])
+
+    def __getitem__(self, index: int) -> tuple:
+        if is_batch_index(index):
+            return self.get_batch(index)
+        return tuple(dataset[index] for dataset in self.datasets)
+
+    @property
+    def supports_batch_fetch(self) -> bool:
+        return all(
+            [
+                getattr(dataset, "supports_batch_fetch", False)
+                for dataset in self.datasets
+            ]
+        )
+
+    def get_batch(self, indices: List[int]) -> tuple:
+        # All domains are indexed with the same indices such that the batches are aligned by construction.
+        return tuple(dataset.get_batch(indices) for dataset in self.datasets)
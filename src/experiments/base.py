@@ -5,6 +5,7 @@ from typing import List
 import numpy as np
 import torch
 
+from src.helper.data import PairedDataHandler
 from src.utils.basic.visualization import (
     plot_train_val_hist,
     visualize_shared_latent_space,
@@ -13,6 +14,30 @@ from src.utils.basic.visualization import (
 from src.utils.torch.evaluation import save_latents_to_csv
 from src.utils.torch.general import get_device, get_latent_distance_loss
 
+# Data loading options that experiments pass through to the data handlers, the batch size, random state and the
+# dropping of the last batch are set by the experiments themselves.
+LOADER_CONFIG_KEYS = [
+    "num_workers",
+    "pin_memory",
+    "persistent_workers",
+    "prefetch_factor",
+    "batch_fetch",
+    "resident",
+]
+
+
+def get_loader_config(loader_config: dict = None) -> dict:
+    if loader_config is None:
+        return {}
+    unknown_keys = [key for key in loader_config if key not in LOADER_CONFIG_KEYS]
+    if len(unknown_keys) > 0:
+        raise RuntimeError(
+            "Unknown loader_config keys: {}, expected any of the following: {}".format(
+                ", ".join(unknown_keys), ", ".join(LOADER_CONFIG_KEYS)
+            )
+        )
+    return dict(loader_config)
+
 
 class BaseExperiment:
     def __init__(
@@ -24,6 +49,7 @@ class BaseExperiment:
         num_epochs: int = 500,
         early_stopping: int = 20,
         random_state: int = 42,
+        loader_config: dict = None,
     ):
         # I/O attributes
         self.output_dir = output_dir
@@ -37,6 +63,9 @@ class BaseExperiment:
         # Other attributes
         self.latent_structure_model_config = latent_structure_model_config
         self.random_state = random_state
+        # Accepts the keys in LOADER_CONFIG_KEYS: num_workers, pin_memory, persistent_workers, prefetch_factor,
+        # batch_fetch and resident
+        self.loader_config = get_loader_config(loader_config)
         self.loss_dict = None
         self.device = get_device()
 
@@ -68,6 +97,7 @@ class BaseTwoDomainExperiment(BaseExperiment):
         num_epochs: int = 500,
         early_stopping: int = 20,
         random_state: int = 42,
+        loader_config: dict = None,
         paired_data: bool = False,
         latent_distance_loss: str = None,
         latent_supervision_rate: float = 0.0,
@@ -80,6 +110,7 @@ class BaseTwoDomainExperiment(BaseExperiment):
             num_epochs=num_epochs,
             early_stopping=early_stopping,
             random_state=random_state,
+            loader_config=loader_config,
         )
 
         self.latent_dcm_config = latent_dcm_config
@@ -93,6 +124,23 @@ class BaseTwoDomainExperiment(BaseExperiment):
         self.domain_configs = None
         self.trained_models = None
 
+    def get_paired_data_loader_dict(self) -> dict:
+        # Joins the splits of both domains such that paired batches are aligned by construction while shuffling.
+        dh = PairedDataHandler(
+            train_val_test_datasets_dicts=[
+                {
+                    k: data_loader.dataset
+                    for k, data_loader in domain_config.data_loader_dict.items()
+                }
+                for domain_config in self.domain_configs
+            ],
+            batch_size=self.batch_size,
+            **self.loader_config,
+            random_state=self.random_state,
+        )
+        dh.get_data_loader_dict()
+        return dh.data_loader_dict
+
     def visualize_shared_latent_space(
         self,
         reduction: str = "umap",
@@ -184,6 +232,7 @@ class BaseExperimentCV:
         num_epochs: int = 500,
         early_stopping: int = 20,
         random_state: int = 42,
+        loader_config: dict = None,
     ):
         self.domain_configs = None
         self.output_dir = output_dir
@@ -194,6 +243,9 @@ class BaseExperimentCV:
         self.num_epochs = num_epochs
         self.early_stopping = early_stopping
         self.random_state = random_state
+        # Accepts the keys in LOADER_CONFIG_KEYS: num_workers, pin_memory, persistent_workers, prefetch_factor,
+        # batch_fetch and resident
+        self.loader_config = get_loader_config(loader_config)
         self.device = get_device()
 
         self.loss_dicts = None
@@ -231,6 +283,7 @@ class BaseTwoDomainExperimentCV(BaseExperimentCV):
         num_epochs: int = 500,
         early_stopping: int = 20,
         random_state: int = 42,
+        loader_config: dict = None,
         paired_data: bool = False,
         latent_distance_loss: str = None,
         latent_supervision_rate: float = 0.0,
@@ -244,6 +297,7 @@ class BaseTwoDomainExperimentCV(BaseExperimentCV):
             num_epochs=num_epochs,
             early_stopping=early_stopping,
             random_state=random_state,
+            loader_config=loader_config,
         )
 
         self.latent_dcm_config = latent_dcm_config
@@ -258,6 +312,23 @@ class BaseTwoDomainExperimentCV(BaseExperimentCV):
         self.domain_configs = None
         self.trained_models = None
 
+    def get_paired_data_loader_dict(self) -> dict:
+        # Joins the splits of both domains such that paired batches are aligned by construction while shuffling.
+        dh = PairedDataHandler(
+            train_val_test_datasets_dicts=[
+                {
+                    k: data_loader.dataset
+                    for k, data_loader in domain_config.data_loader_dict.items()
+                }
+                for domain_config in self.domain_configs
+            ],
+            batch_size=self.batch_size,
+            **self.loader_config,
+            random_state=self.random_state,
+        )
+        dh.get_data_loader_dict()
+        return dh.data_loader_dict
+
     def visualize_shared_latent_space(
         self,
         fold_id: int,
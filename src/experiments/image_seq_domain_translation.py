@@ -11,6 +11,7 @@ from src.utils.torch.data import (
     init_seq_dataset,
 )
 from src.utils.torch.exp import train_val_test_loop_two_domains
+from src.utils.torch.general import get_batch_transformation_dict_for_train_val_test
 from src.utils.torch.model import (
     get_domain_configuration,
     get_latent_model_configuration,
@@ -32,6 +33,7 @@ class ImageSeqTranslationExperiment(BaseTwoDomainExperiment):
         train_val_test_split: List[float] = [0.7, 0.2, 0.1],
         batch_size: int = 64,
         random_state: int = 42,
+        loader_config: dict = None,
         paired_data: bool = False,
         latent_distance_loss: str = None,
         latent_supervision_rate: float = 0.0,
@@ -45,6 +47,7 @@ class ImageSeqTranslationExperiment(BaseTwoDomainExperiment):
             train_val_test_split=train_val_test_split,
             batch_size=batch_size,
             random_state=random_state,
+            loader_config=loader_config,
             paired_data=paired_data,
             latent_distance_loss=latent_distance_loss,
             latent_supervision_rate=latent_supervision_rate,
@@ -72,7 +75,10 @@ class ImageSeqTranslationExperiment(BaseTwoDomainExperiment):
         image_dir = self.image_data_config["image_dir"]
         label_fname = self.image_data_config["label_fname"]
         self.image_data_set = init_nuclei_image_dataset(
-            image_dir=image_dir, label_fname=label_fname
+            image_dir=image_dir,
+            label_fname=label_fname,
+            use_image_store=self.image_data_config.get("use_image_store", False),
+            cache_bytes=self.image_data_config.get("cache_bytes", 0),
         )
         self.image_data_key = self.image_data_config["data_key"]
         self.image_label_key = self.image_data_config["label_key"]
@@ -82,7 +88,9 @@ class ImageSeqTranslationExperiment(BaseTwoDomainExperiment):
         self.seq_data_key = self.seq_data_config["data_key"]
         self.seq_label_key = self.seq_data_config["label_key"]
         self.seq_data_set = init_seq_dataset(
-            seq_data_and_labels_fname=seq_data_and_labels_fname
+            seq_data_and_labels_fname=seq_data_and_labels_fname,
+            use_cache=self.seq_data_config.get("use_cache", True),
+            backing_store=self.seq_data_config.get("backing_store", "memory"),
         )
 
     def get_and_set_paired_training_idc(self):
@@ -101,37 +109,31 @@ class ImageSeqTranslationExperiment(BaseTwoDomainExperiment):
                 size=int(n_samples * self.latent_supervision_rate),
                 replace=False,
             )
-            self.seq_data_set.paired_training_idc = paired_training_idc
-            self.image_data_set.paired_training_idc = paired_training_idc
+            self.seq_data_set.set_paired_training_idc(paired_training_idc)
+            self.image_data_set.set_paired_training_idc(paired_training_idc)
 
     def initialize_image_data_loader_dict(self):
         dh = DataHandler(
             dataset=self.image_data_set,
             batch_size=self.batch_size,
-            num_workers=0,
+            **self.loader_config,
             random_state=self.random_state,
             transformation_dict=self.image_data_transform_pipeline_dict,
         )
         dh.stratified_train_val_test_split(splits=self.train_val_test_split)
-        dh.get_data_loader_dict(
-            shuffle=self.latent_distance_loss is None
-            or self.latent_supervision_rate == 0
-        )
+        dh.get_data_loader_dict()
         self.image_data_loader_dict = dh.data_loader_dict
 
     def initialize_seq_data_loader_dict(self):
         dh = DataHandler(
             dataset=self.seq_data_set,
             batch_size=self.batch_size,
-            num_workers=0,
+            **self.loader_config,
             random_state=self.random_state,
             transformation_dict=self.seq_data_transform_pipeline_dict,
         )
         dh.stratified_train_val_test_split(splits=self.train_val_test_split)
-        dh.get_data_loader_dict(
-            shuffle=self.latent_distance_loss is None
-            or self.latent_supervision_rate == 0
-        )
+        dh.get_data_loader_dict()
         self.seq_data_loader_dict = dh.data_loader_dict
 
     def initialize_image_domain_config(self, train_model: bool = True):
@@ -151,6 +153,9 @@ class ImageSeqTranslationExperiment(BaseTwoDomainExperiment):
             optimizer_dict=optimizer_config,
             recon_loss_fct_dict=recon_loss_config,
             train_model=train_model,
+            batch_transform_dict=get_batch_transformation_dict_for_train_val_test(
+                self.image_data_config.get("batch_augmentation")
+            ),
         )
         self.domain_configs.append(image_domain_config)
 
@@ -216,6 +221,17 @@ class ImageSeqTranslationExperiment(BaseTwoDomainExperiment):
         use_latent_discriminator: bool = True,
         use_latent_structure_model: bool = False,
         save_freq: int = 50,
+        share_encoder_forward: bool = False,
+        amp: str = None,
+        accumulation_steps: int = 1,
+        joint_optimizer: bool = False,
+        keep_last_checkpoints: int = None,
+        async_visualization: bool = False,
+        early_stopping_metric: str = "recon_loss",
+        early_stopping_smoothing: float = 0.0,
+        knn_backend: str = "exact",
+        knn_backend_kwargs: dict = None,
+        latent_cache_bytes: int = 2 ** 28,
     ):
         self.trained_models, self.loss_dict = train_val_test_loop_two_domains(
             output_dir=self.output_dir,
@@ -234,6 +250,20 @@ class ImageSeqTranslationExperiment(BaseTwoDomainExperiment):
             early_stopping=self.early_stopping,
             device=self.device,
             paired_mode=self.paired_data,
+            paired_data_loader_dict=self.get_paired_data_loader_dict()
+            if self.paired_data
+            else None,
+            knn_backend=knn_backend,
+            knn_backend_kwargs=knn_backend_kwargs,
+            latent_cache_bytes=latent_cache_bytes,
+            early_stopping_smoothing=early_stopping_smoothing,
+            early_stopping_metric=early_stopping_metric,
+            async_visualization=async_visualization,
+            keep_last_checkpoints=keep_last_checkpoints,
+            joint_optimizer=joint_optimizer,
+            accumulation_steps=accumulation_steps,
+            amp=amp,
+            share_encoder_forward=share_encoder_forward,
         )
 
     def save_latents_to_csv(
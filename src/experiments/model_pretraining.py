@@ -14,7 +14,10 @@ from src.utils.torch.evaluation import (
     evaluate_latent_clf_one_domain,
 )
 from src.utils.torch.exp import train_val_test_loop_single_domain
-from src.utils.torch.general import get_device
+from src.utils.torch.general import (
+    get_batch_transformation_dict_for_train_val_test,
+    get_device,
+)
 from src.utils.torch.model import (
     get_domain_configuration,
     get_latent_model_configuration,
@@ -34,6 +37,7 @@ class PretrainAeExperiment(BaseExperiment):
         num_epochs: int = 64,
         early_stopping: int = -1,
         random_state: int = 42,
+        loader_config: dict = None,
     ):
         super().__init__(
             output_dir=output_dir,
@@ -42,6 +46,7 @@ class PretrainAeExperiment(BaseExperiment):
             num_epochs=num_epochs,
             early_stopping=early_stopping,
             random_state=random_state,
+            loader_config=loader_config,
         )
 
         self.data_config = data_config
@@ -65,7 +70,10 @@ class PretrainAeExperiment(BaseExperiment):
         image_dir = self.data_config["image_dir"]
         label_fname = self.data_config["label_fname"]
         self.data_set = init_nuclei_image_dataset(
-            image_dir=image_dir, label_fname=label_fname
+            image_dir=image_dir,
+            label_fname=label_fname,
+            use_image_store=self.data_config.get("use_image_store", False),
+            cache_bytes=self.data_config.get("cache_bytes", 0),
         )
         self.data_key = self.data_config["data_key"]
         self.label_key = self.data_config["label_key"]
@@ -75,14 +83,16 @@ class PretrainAeExperiment(BaseExperiment):
         self.data_key = self.data_config["data_key"]
         self.label_key = self.data_config["label_key"]
         self.data_set = init_seq_dataset(
-            seq_data_and_labels_fname=seq_data_and_labels_fname
+            seq_data_and_labels_fname=seq_data_and_labels_fname,
+            use_cache=self.data_config.get("use_cache", True),
+            backing_store=self.data_config.get("backing_store", "memory"),
         )
 
     def initialize_data_loader_dict(self, drop_last_batch: bool = False):
         dh = DataHandler(
             dataset=self.data_set,
             batch_size=self.batch_size,
-            num_workers=0,
+            **self.loader_config,
             random_state=self.random_state,
             transformation_dict=self.data_transform_pipeline_dict,
             drop_last_batch=drop_last_batch,
@@ -104,6 +114,9 @@ class PretrainAeExperiment(BaseExperiment):
             label_key=self.label_key,
             optimizer_dict=optimizer_config,
             recon_loss_fct_dict=recon_loss_config,
+            batch_transform_dict=get_batch_transformation_dict_for_train_val_test(
+                self.data_config.get("batch_augmentation")
+            ),
         )
 
     def initialize_clf_model(self):
@@ -124,6 +137,7 @@ class PretrainAeExperiment(BaseExperiment):
         lamb: float = 0.00000001,
         use_latent_structure_model: bool = False,
         save_freq: int = 50,
+        amp: str = None,
     ):
         self.trained_models, self.loss_dict = train_val_test_loop_single_domain(
             output_dir=self.output_dir,
@@ -137,6 +151,7 @@ class PretrainAeExperiment(BaseExperiment):
             lamb=lamb,
             use_latent_structure_model=use_latent_structure_model,
             save_freq=save_freq,
+            amp=amp,
         )
 
         if use_latent_structure_model:
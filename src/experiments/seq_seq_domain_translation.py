@@ -33,6 +33,7 @@ class SeqSeqTranslationExperiment(BaseTwoDomainExperiment):
         train_val_test_split: List[float] = [0.7, 0.2, 0.1],
         batch_size: int = 64,
         random_state: int = 42,
+        loader_config: dict = None,
         paired_data: bool = False,
         latent_distance_loss: str = None,
         latent_supervision_rate: float = 0.0,
@@ -46,6 +47,7 @@ class SeqSeqTranslationExperiment(BaseTwoDomainExperiment):
             train_val_test_split=train_val_test_split,
             batch_size=batch_size,
             random_state=random_state,
+            loader_config=loader_config,
             paired_data=paired_data,
             latent_distance_loss=latent_distance_loss,
             latent_supervision_rate=latent_supervision_rate,
@@ -73,7 +75,9 @@ class SeqSeqTranslationExperiment(BaseTwoDomainExperiment):
         self.seq_data_key_1 = self.seq_data_config_1["data_key"]
         self.seq_label_key_1 = self.seq_data_config_1["label_key"]
         self.seq_data_set_1 = init_seq_dataset(
-            seq_data_and_labels_fname=seq_data_and_labels_fname
+            seq_data_and_labels_fname=seq_data_and_labels_fname,
+            use_cache=self.seq_data_config_1.get("use_cache", True),
+            backing_store=self.seq_data_config_1.get("backing_store", "memory"),
         )
 
     def initialize_seq_data_set_2(self):
@@ -81,7 +85,9 @@ class SeqSeqTranslationExperiment(BaseTwoDomainExperiment):
         self.seq_data_key_2 = self.seq_data_config_2["data_key"]
         self.seq_label_key_2 = self.seq_data_config_2["label_key"]
         self.seq_data_set_2 = init_seq_dataset(
-            seq_data_and_labels_fname=seq_data_and_labels_fname
+            seq_data_and_labels_fname=seq_data_and_labels_fname,
+            use_cache=self.seq_data_config_2.get("use_cache", True),
+            backing_store=self.seq_data_config_2.get("backing_store", "memory"),
         )
 
     def get_and_set_paired_training_idc(self):
@@ -99,37 +105,31 @@ class SeqSeqTranslationExperiment(BaseTwoDomainExperiment):
                 size=int(n_samples * self.latent_supervision_rate),
                 replace=False,
             )
-            self.seq_data_set_1.paired_training_idc = paired_training_idc
-            self.seq_data_set_2.paired_training_idc = paired_training_idc
+            self.seq_data_set_1.set_paired_training_idc(paired_training_idc)
+            self.seq_data_set_2.set_paired_training_idc(paired_training_idc)
 
     def initialize_seq_data_loader_dict_1(self):
         dh = DataHandler(
             dataset=self.seq_data_set_1,
             batch_size=self.batch_size,
-            num_workers=0,
+            **self.loader_config,
             random_state=self.random_state,
             transformation_dict=self.seq_data_transform_pipeline_dict_1,
         )
         dh.stratified_train_val_test_split(splits=self.train_val_test_split)
-        dh.get_data_loader_dict(
-            shuffle=self.latent_distance_loss is None
-            or self.latent_supervision_rate == 0
-        )
+        dh.get_data_loader_dict()
         self.seq_data_loader_dict_1 = dh.data_loader_dict
 
     def initialize_seq_data_loader_dict_2(self):
         dh = DataHandler(
             dataset=self.seq_data_set_2,
             batch_size=self.batch_size,
-            num_workers=0,
+            **self.loader_config,
             random_state=self.random_state,
             transformation_dict=self.seq_data_transform_pipeline_dict_2,
         )
         dh.stratified_train_val_test_split(splits=self.train_val_test_split)
-        dh.get_data_loader_dict(
-            shuffle=self.latent_distance_loss is None
-            or self.latent_supervision_rate == 0
-        )
+        dh.get_data_loader_dict()
         self.seq_data_loader_dict_2 = dh.data_loader_dict
 
     def initialize_seq_domain_config_1(
@@ -219,6 +219,17 @@ class SeqSeqTranslationExperiment(BaseTwoDomainExperiment):
         use_latent_discriminator: bool = True,
         use_latent_structure_model: bool = False,
         save_freq: int = 50,
+        share_encoder_forward: bool = False,
+        amp: str = None,
+        accumulation_steps: int = 1,
+        joint_optimizer: bool = False,
+        keep_last_checkpoints: int = None,
+        async_visualization: bool = False,
+        early_stopping_metric: str = "recon_loss",
+        early_stopping_smoothing: float = 0.0,
+        knn_backend: str = "exact",
+        knn_backend_kwargs: dict = None,
+        latent_cache_bytes: int = 2 ** 28,
     ):
         self.trained_models, self.loss_dict = train_val_test_loop_two_domains(
             output_dir=self.output_dir,
@@ -238,6 +249,20 @@ class SeqSeqTranslationExperiment(BaseTwoDomainExperiment):
             device=self.device,
             paired_mode=self.paired_data,
             latent_distance_loss=self.latent_distance_loss,
+            paired_data_loader_dict=self.get_paired_data_loader_dict()
+            if self.paired_data
+            else None,
+            knn_backend=knn_backend,
+            knn_backend_kwargs=knn_backend_kwargs,
+            latent_cache_bytes=latent_cache_bytes,
+            early_stopping_smoothing=early_stopping_smoothing,
+            early_stopping_metric=early_stopping_metric,
+            async_visualization=async_visualization,
+            keep_last_checkpoints=keep_last_checkpoints,
+            joint_optimizer=joint_optimizer,
+            accumulation_steps=accumulation_steps,
+            amp=amp,
+            share_encoder_forward=share_encoder_forward,
         )
 
     def save_latents_to_csv(
@@ -288,6 +313,7 @@ class SeqSeqTranslationExperimentCV(BaseTwoDomainExperimentCV):
         train_val_split: List[float] = [0.8, 0.2],
         batch_size: int = 64,
         random_state: int = 42,
+        loader_config: dict = None,
         paired_data: bool = False,
         latent_distance_loss: str = None,
         latent_supervision_rate: float = 0.0,
@@ -302,6 +328,7 @@ class SeqSeqTranslationExperimentCV(BaseTwoDomainExperimentCV):
             train_val_split=train_val_split,
             batch_size=batch_size,
             random_state=random_state,
+            loader_config=loader_config,
             paired_data=paired_data,
             latent_distance_loss=latent_distance_loss,
             latent_supervision_rate=latent_supervision_rate,
@@ -336,7 +363,9 @@ class SeqSeqTranslationExperimentCV(BaseTwoDomainExperimentCV):
         self.seq_data_key_1 = self.seq_data_config_1["data_key"]
         self.seq_label_key_1 = self.seq_data_config_1["label_key"]
         self.seq_data_set_1 = init_seq_dataset(
-            seq_data_and_labels_fname=seq_data_and_labels_fname
+            seq_data_and_labels_fname=seq_data_and_labels_fname,
+            use_cache=self.seq_data_config_1.get("use_cache", True),
+            backing_store=self.seq_data_config_1.get("backing_store", "memory"),
         )
 
     def initialize_seq_data_set_2(self):
@@ -344,7 +373,9 @@ class SeqSeqTranslationExperimentCV(BaseTwoDomainExperimentCV):
         self.seq_data_key_2 = self.seq_data_config_2["data_key"]
         self.seq_label_key_2 = self.seq_data_config_2["label_key"]
         self.seq_data_set_2 = init_seq_dataset(
-            seq_data_and_labels_fname=seq_data_and_labels_fname
+            seq_data_and_labels_fname=seq_data_and_labels_fname,
+            use_cache=self.seq_data_config_2.get("use_cache", True),
+            backing_store=self.seq_data_config_2.get("backing_store", "memory"),
         )
 
     def get_and_set_paired_training_idc(self):
@@ -363,8 +394,8 @@ class SeqSeqTranslationExperimentCV(BaseTwoDomainExperimentCV):
                 size=int(n_samples * self.latent_supervision_rate),
                 replace=False,
             )
-            self.seq_data_set_1.paired_training_idc = paired_training_idc
-            self.seq_data_set_2.paired_training_idc = paired_training_idc
+            self.seq_data_set_1.set_paired_training_idc(paired_training_idc)
+            self.seq_data_set_2.set_paired_training_idc(paired_training_idc)
 
     def initialize_seq_data_loader_dict_1(self):
         dh = DataHandlerCV(
@@ -372,12 +403,11 @@ class SeqSeqTranslationExperimentCV(BaseTwoDomainExperimentCV):
             n_folds=self.n_folds,
             train_val_split=self.train_val_split,
             batch_size=self.batch_size,
-            num_workers=0,
+            **self.loader_config,
             random_state=self.random_state,
             transformation_dict=self.seq_data_transform_pipeline_dict_1,
         )
         dh.stratified_kfold_split()
-        # dh.get_data_loader_dicts(shuffle=self.latent_distance_loss is None or self.latent_supervision_rate == 0)
         dh.get_data_loader_dicts()
         self.seq_data_loader_dicts_1 = dh.data_loader_dicts
 
@@ -387,12 +417,11 @@ class SeqSeqTranslationExperimentCV(BaseTwoDomainExperimentCV):
             n_folds=self.n_folds,
             train_val_split=self.train_val_split,
             batch_size=self.batch_size,
-            num_workers=0,
+            **self.loader_config,
             random_state=self.random_state,
             transformation_dict=self.seq_data_transform_pipeline_dict_2,
         )
         dh.stratified_kfold_split()
-        # dh.get_data_loader_dicts(shuffle=self.latent_distance_loss is None or self.latent_supervision_rate == 0)
         dh.get_data_loader_dicts()
         self.seq_data_loader_dicts_2 = dh.data_loader_dicts
 
@@ -497,6 +526,17 @@ class SeqSeqTranslationExperimentCV(BaseTwoDomainExperimentCV):
         save_freq: int = 100,
         visualize_results: bool = True,
         visualization_latents_reduction: str = "umap",
+        share_encoder_forward: bool = False,
+        amp: str = None,
+        accumulation_steps: int = 1,
+        joint_optimizer: bool = False,
+        keep_last_checkpoints: int = None,
+        async_visualization: bool = False,
+        early_stopping_metric: str = "recon_loss",
+        early_stopping_smoothing: float = 0.0,
+        knn_backend: str = "exact",
+        knn_backend_kwargs: dict = None,
+        latent_cache_bytes: int = 2 ** 28,
     ):
         self.loss_dicts = []
 
@@ -566,6 +606,20 @@ class SeqSeqTranslationExperimentCV(BaseTwoDomainExperimentCV):
                 device=self.device,
                 paired_mode=self.paired_data,
                 latent_distance_loss=self.latent_distance_loss,
+                paired_data_loader_dict=self.get_paired_data_loader_dict()
+                if self.paired_data
+                else None,
+                knn_backend=knn_backend,
+                knn_backend_kwargs=knn_backend_kwargs,
+                latent_cache_bytes=latent_cache_bytes,
+                early_stopping_smoothing=early_stopping_smoothing,
+                early_stopping_metric=early_stopping_metric,
+                async_visualization=async_visualization,
+                keep_last_checkpoints=keep_last_checkpoints,
+                joint_optimizer=joint_optimizer,
+                accumulation_steps=accumulation_steps,
+                amp=amp,
+                share_encoder_forward=share_encoder_forward,
             )
             self.loss_dicts.append(loss_dict)
 
@@ -667,6 +721,17 @@ class SeqSeqTranslationExperimentCV(BaseTwoDomainExperimentCV):
         use_latent_discriminator: bool = True,
         use_latent_structure_model: bool = False,
         save_freq: int = 50,
+        share_encoder_forward: bool = False,
+        amp: str = None,
+        accumulation_steps: int = 1,
+        joint_optimizer: bool = False,
+        keep_last_checkpoints: int = None,
+        async_visualization: bool = False,
+        early_stopping_metric: str = "recon_loss",
+        early_stopping_smoothing: float = 0.0,
+        knn_backend: str = "exact",
+        knn_backend_kwargs: dict = None,
+        latent_cache_bytes: int = 2 ** 28,
     ):
         domain_names = [self.domain_configs[0].name, self.domain_configs[1].name]
         model_file_locs = get_model_file_list_for_two_domain_experiment(
@@ -731,6 +796,20 @@ class SeqSeqTranslationExperimentCV(BaseTwoDomainExperimentCV):
                 device=self.device,
                 paired_mode=self.paired_data,
                 latent_distance_loss=self.latent_distance_loss,
+                paired_data_loader_dict=self.get_paired_data_loader_dict()
+                if self.paired_data
+                else None,
+                knn_backend=knn_backend,
+                knn_backend_kwargs=knn_backend_kwargs,
+                latent_cache_bytes=latent_cache_bytes,
+                early_stopping_smoothing=early_stopping_smoothing,
+                early_stopping_metric=early_stopping_metric,
+                async_visualization=async_visualization,
+                keep_last_checkpoints=keep_last_checkpoints,
+                joint_optimizer=joint_optimizer,
+                accumulation_steps=accumulation_steps,
+                amp=amp,
+                share_encoder_forward=share_encoder_forward,
             )
             if use_latent_structure_model:
                 confusion_dict = evaluate_latent_clf_two_domains(
@@ -66,14 +66,22 @@ def vae_loss(inputs: Tensor, outputs: Tensor, mu: Tensor, log_var: Tensor) -> Te
     return vae_loss
 
 
-def max_discrepancy_loss(inputs: Tensor, outputs: Tensor) -> Tensor:
-    n_samples, _ = inputs.size()
+def max_discrepancy_loss(
+    inputs: Tensor, outputs: Tensor, max_chunk_elements: int = 2 ** 24
+) -> Tensor:
+    n_samples, n_features = inputs.size()
     loss = nn.L1Loss()(inputs, outputs) * (n_samples - 1) * n_samples
+
+    # Sum of the mean absolute differences of all unpaired samples i != j. The pairwise L1 distances are computed for
+    # chunks of rows such that at most max_chunk_elements distances are held in memory at once.
+    chunk_size = max(1, max_chunk_elements // max(n_samples, 1))
     discrepancy = 0
-    for i in range(n_samples):
-        for j in range(n_samples):
-            if i != j:
-                discrepancy += torch.mean(torch.abs(inputs[i] - outputs[j]))
+    for start in range(0, n_samples, chunk_size):
+        distances = torch.cdist(inputs[start : start + chunk_size], outputs, p=1)
+        # The paired distances of the chunk are on its diagonal with offset start
+        discrepancy += distances.sum() - distances.diagonal(offset=start).sum()
+    discrepancy = discrepancy / n_features
+
     if discrepancy == 0:
         return loss * discrepancy
     else:
@@ -1,10 +1,47 @@
-from typing import Tuple
+from typing import Tuple, Union
 
+import torch
 from torch import Tensor
 
 
 def accuracy(outputs: Tensor, labels: Tensor) -> Tuple[float, int]:
+    correct, n_samples = correct_predictions(outputs, labels)
+    return correct.item(), n_samples
+
+
+def correct_predictions(outputs: Tensor, labels: Tensor) -> Tuple[Tensor, int]:
+    # Keeps the number of correct predictions on the device to avoid a host sync per batch
     n_samples = outputs.size(0)
     preds = outputs.argmax(dim=1).view(-1)
-    correct = preds.eq(labels.view(-1)).float().sum().item()
+    correct = preds.eq(labels.view(-1)).float().sum()
     return correct, n_samples
+
+
+class MetricAccumulator(object):
+    def __init__(self):
+        self.sums = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.sums
+
+    def add(self, key: str, value: Union[Tensor, float]) -> None:
+        # Tensors are summed in fp32 on their device and only read back once by compute
+        if isinstance(value, Tensor):
+            value = value.detach().float()
+        if key in self.sums:
+            self.sums[key] = self.sums[key] + value
+        else:
+            self.sums[key] = value
+
+    def compute(self) -> dict:
+        # Stack all tensor sums such that they are copied to the host with a single sync
+        tensor_keys = [k for k, v in self.sums.items() if isinstance(v, Tensor)]
+        summed_values = {
+            k: v for k, v in self.sums.items() if not isinstance(v, Tensor)
+        }
+        if len(tensor_keys) > 0:
+            values = torch.stack(
+                [self.sums[k].float().reshape(()) for k in tensor_keys]
+            ).tolist()
+            summed_values.update(dict(zip(tensor_keys, values)))
+        return summed_values
@@ -0,0 +1,73 @@
+from collections import OrderedDict
+from typing import Any, Hashable
+
+from torch import Tensor
+
+
+class LRUTensorCache(object):
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.cache = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.cache)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.cache
+
+    def get(self, key: Hashable, default: Any = None) -> Tensor:
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return self.cache[key]
+        self.misses += 1
+        return default
+
+    def put(self, key: Hashable, value: Tensor):
+        size = self.get_tensor_bytes(value)
+        # Entries that would never fit are not cached instead of flushing the whole cache for them.
+        if size > self.max_bytes:
+            return
+        if key in self.cache:
+            self.current_bytes -= self.get_tensor_bytes(self.cache.pop(key))
+        while self.current_bytes + size > self.max_bytes:
+            _, evicted = self.cache.popitem(last=False)
+            self.current_bytes -= self.get_tensor_bytes(evicted)
+            self.evictions += 1
+        self.cache[key] = value
+        self.current_bytes += size
+
+    def clear(self):
+        self.cache.clear()
+        self.current_bytes = 0
+
+    def reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_info(self) -> dict:
+        info = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.cache),
+            "current_bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+        }
+        return info
+
+    @staticmethod
+    def get_tensor_bytes(tensor: Any) -> int:
+        # Containers of tensors are accounted for by the sum of their tensors, any other values are not counted.
+        if isinstance(tensor, dict):
+            return sum(LRUTensorCache.get_tensor_bytes(v) for v in tensor.values())
+        if isinstance(tensor, (list, tuple)):
+            return sum(LRUTensorCache.get_tensor_bytes(v) for v in tensor)
+        if isinstance(tensor, Tensor):
+            return tensor.element_size() * tensor.nelement()
+        return 0
@@ -0,0 +1,104 @@
+import logging
+import os
+import queue
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, List
+
+import torch
+from torch import Tensor
+
+
+class CheckpointWriter(object):
+    def __init__(self, keep_last: int = None, max_pending: int = 1):
+        if keep_last is not None and keep_last < 1:
+            raise RuntimeError(
+                "The number of checkpoints to keep must be positive, got {}.".format(
+                    keep_last
+                )
+            )
+        self.keep_last = keep_last
+        # Bounds the number of snapshots that are held in device memory while waiting to be written.
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.checkpoint_locs = deque()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def save(self, state_dicts: Dict[str, dict], checkpoint_dir: str):
+        self.raise_error()
+        # Snapshot the states on the device they live on, the live models are neither moved nor synchronized.
+        snapshot = {
+            fname: self.get_snapshot(state_dict)
+            for fname, state_dict in state_dicts.items()
+        }
+        self.queue.put((checkpoint_dir, snapshot))
+
+    def flush(self):
+        self.queue.join()
+        self.raise_error()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.raise_error()
+
+    def raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError("Writing a checkpoint failed.") from error
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                checkpoint_dir, snapshot = item
+                self.write(checkpoint_dir=checkpoint_dir, snapshot=snapshot)
+            except Exception as exception:
+                logging.error("Writing a checkpoint failed: {}".format(exception))
+                self.error = exception
+            finally:
+                self.queue.task_done()
+
+    def write(self, checkpoint_dir: str, snapshot: Dict[str, dict]):
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        locs = []
+        for fname, state_dict in snapshot.items():
+            loc = os.path.join(checkpoint_dir, fname)
+            # Checkpoints are stored on the cpu as before, written to a temporary file first such that a checkpoint is
+            # never left half-written.
+            tmp_loc = loc + ".tmp"
+            torch.save(self.get_snapshot(state_dict, device="cpu"), tmp_loc)
+            os.replace(tmp_loc, loc)
+            locs.append(loc)
+
+        self.checkpoint_locs.append(locs)
+        if self.keep_last is not None:
+            while len(self.checkpoint_locs) > self.keep_last:
+                self.remove(self.checkpoint_locs.popleft())
+
+    @staticmethod
+    def remove(locs: List[str]):
+        # Only the files of the checkpoint are removed, other outputs in the directory are kept.
+        for loc in locs:
+            if os.path.exists(loc):
+                os.remove(loc)
+        checkpoint_dir = os.path.dirname(locs[0])
+        if os.path.isdir(checkpoint_dir) and len(os.listdir(checkpoint_dir)) == 0:
+            os.rmdir(checkpoint_dir)
+
+    @staticmethod
+    def get_snapshot(state_dict: dict, device: str = None) -> OrderedDict:
+        snapshot = OrderedDict()
+        for key, value in state_dict.items():
+            if isinstance(value, Tensor):
+                value = value.detach()
+                value = value.clone() if device is None else value.to(device, copy=True)
+            snapshot[key] = value
+        # Keep the version information that is used by load_state_dict.
+        if hasattr(state_dict, "_metadata"):
+            snapshot._metadata = state_dict._metadata
+        return snapshot
@@ -0,0 +1,66 @@
+import logging
+
+import torch
+from torch.nn import Module
+
+
+def get_compile_error_types() -> tuple:
+    # Errors raised by the compiler stack, errors raised by the model itself are not among them
+    try:
+        from torch._dynamo import exc
+    except ImportError:
+        return ()
+    names = ["BackendCompilerFailed", "TorchRuntimeError", "Unsupported"]
+    return tuple(getattr(exc, name) for name in names if hasattr(exc, name))
+
+
+class CompiledModule(Module):
+    def __init__(self, module: Module):
+        super().__init__()
+        # The original module is the only submodule such that the parameters, buffers, modes and the device placement
+        # are shared with it
+        self.module = module
+        self.compiled_forward = torch.compile(module.forward)
+        self.compile_failed = False
+
+    def forward(self, *args, **kwargs):
+        if self.compile_failed:
+            return self.module(*args, **kwargs)
+        # Compilation happens lazily on the first call and again whenever the guards fail, e.g. for a new batch size,
+        # mode or input dtype. Compile errors are raised before the graph is run, if the eager forward succeeds the
+        # model is permanently switched to it. Otherwise the error is one of the model itself and raised as is.
+        try:
+            return self.compiled_forward(*args, **kwargs)
+        except get_compile_error_types() as exception:
+            output = self.module(*args, **kwargs)
+            logging.error(
+                "Compilation of {} failed, falling back to eager mode: {}".format(
+                    type(self.module).__name__, exception
+                )
+            )
+            self.compile_failed = True
+            return output
+
+    def __getattr__(self, name: str):
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            # The original module itself might not be set yet, e.g. while unpickling
+            if name == "module":
+                raise
+            return getattr(self.module, name)
+
+    def __setattr__(self, name: str, value):
+        # Once the wrapper is set up all other attributes, e.g. the trainable or updated flags, are set on the original
+        # module
+        if "compile_failed" in self.__dict__ and name not in self.__dict__:
+            setattr(self.module, name, value)
+        else:
+            super().__setattr__(name, value)
+
+    # Checkpoints hold the states of the original module with its keys, they can be loaded with or without compilation
+    def state_dict(self, *args, **kwargs):
+        return self.module.state_dict(*args, **kwargs)
+
+    def load_state_dict(self, state_dict: dict, strict: bool = True):
+        return self.module.load_state_dict(state_dict, strict=strict)
@@ -1,3 +1,4 @@
+import torch
 from torch import Tensor
 
 
@@ -18,3 +19,44 @@ class UnNormalize(object):
         for t, m, s in zip(input, self.mean, self.std):
             t.mul_(s).add_(m)
         return Tensor
+
+
+class RandomBatchFlipRotation(object):
+    def __init__(
+        self,
+        horizontal_flip: bool = True,
+        vertical_flip: bool = True,
+        rotation: bool = False,
+        p: float = 0.5,
+    ):
+        self.horizontal_flip = horizontal_flip
+        self.vertical_flip = vertical_flip
+        self.rotation = rotation
+        self.p = p
+
+    def __call__(self, inputs: Tensor) -> Tensor:
+        # Expects a collated batch of size (N, C, H, W), samples are augmented independently via one flip per mask.
+        inputs = inputs.clone()
+        n_samples = inputs.size(0)
+        if self.horizontal_flip:
+            idc = self.get_random_idc(n_samples, device=inputs.device)
+            inputs[idc] = torch.flip(inputs[idc], dims=[-1])
+        if self.vertical_flip:
+            idc = self.get_random_idc(n_samples, device=inputs.device)
+            inputs[idc] = torch.flip(inputs[idc], dims=[-2])
+        if self.rotation:
+            if inputs.size(-1) != inputs.size(-2):
+                raise RuntimeError(
+                    "Random 90 degree rotations require square inputs, got {}.".format(
+                        tuple(inputs.size()[-2:])
+                    )
+                )
+            n_rotations = torch.randint(4, (n_samples,), device=inputs.device)
+            for k in range(1, 4):
+                idc = torch.nonzero(n_rotations == k, as_tuple=False).squeeze(1)
+                inputs[idc] = torch.rot90(inputs[idc], k=k, dims=[-2, -1])
+        return inputs
+
+    def get_random_idc(self, n_samples: int, device: torch.device) -> Tensor:
+        mask = torch.rand(n_samples, device=device) < self.p
+        return torch.nonzero(mask, as_tuple=False).squeeze(1)
@@ -1,11 +1,113 @@
+import inspect
+import logging
+import random
 from typing import Iterable, List
 
 import numpy as np
 import torch
 from sklearn.model_selection import train_test_split, StratifiedKFold
-from torch.utils.data import DataLoader, RandomSampler, SequentialSampler
+from torch.utils.data import (
+    BatchSampler,
+    DataLoader,
+    Dataset,
+    RandomSampler,
+    Sampler,
+    SequentialSampler,
+)
 
-from src.data.datasets import LabeledDataset, TorchTransformableSubset
+from src.data.datasets import (
+    LabeledDataset,
+    PairedDataset,
+    TorchTransformableSubset,
+)
+from src.utils.torch.general import get_device
+
+
+def seed_worker(worker_id: int):
+    # Torch seeds every worker from the base seed of the loader, numpy and random need to be derived from it.
+    worker_seed = torch.initial_seed() % 2 ** 32
+    np.random.seed(worker_seed)
+    random.seed(worker_seed)
+
+
+class ResidentDataLoader(object):
+    def __init__(
+        self,
+        dataset: Dataset,
+        batch_size: int = 64,
+        shuffle: bool = False,
+        drop_last: bool = True,
+        device: str = "cuda:0",
+        generator: torch.Generator = None,
+    ):
+        if not getattr(dataset, "supports_batch_fetch", False):
+            raise RuntimeError(
+                "The resident data mode requires a dataset that implements get_batch,"
+                " got {}.".format(type(dataset).__name__)
+            )
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.device = device
+        self.generator = generator
+
+        # Gather the complete split once and keep the tensors contiguous on the device, all other entries (e.g. the
+        # sample ids) stay on the host. Paired datasets yield one batch per domain.
+        self.n_samples = len(dataset)
+        samples = dataset.get_batch(np.arange(self.n_samples))
+        self.paired = isinstance(samples, tuple)
+        if not self.paired:
+            samples = (samples,)
+        self.tensors = []
+        self.host_data = []
+        for domain_samples in samples:
+            tensors = {}
+            host_data = {}
+            for k, v in domain_samples.items():
+                if isinstance(v, torch.Tensor):
+                    tensors[k] = v.to(self.device).contiguous()
+                else:
+                    host_data[k] = np.asarray(v)
+            self.tensors.append(tensors)
+            self.host_data.append(host_data)
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            return self.n_samples // self.batch_size
+        return (self.n_samples + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        # The permutation is drawn on the host such that the host entries can be indexed without a device sync, it is
+        # copied to the device once per epoch.
+        if self.shuffle:
+            host_idc = torch.randperm(self.n_samples, generator=self.generator)
+            device_idc = host_idc.to(self.device)
+        else:
+            host_idc = None
+            device_idc = None
+
+        for batch_idx in range(len(self)):
+            start = batch_idx * self.batch_size
+            end = min(start + self.batch_size, self.n_samples)
+            if device_idc is None:
+                batch_device_idc = slice(start, end)
+                batch_host_idc = slice(start, end)
+            else:
+                batch_device_idc = device_idc[start:end]
+                batch_host_idc = host_idc[start:end].numpy()
+
+            batches = []
+            for tensors, host_data in zip(self.tensors, self.host_data):
+                batch = {k: v[batch_device_idc] for k, v in tensors.items()}
+                for k, v in host_data.items():
+                    batch[k] = v[batch_host_idc].tolist()
+                batches.append(batch)
+
+            if self.paired:
+                yield tuple(batches)
+            else:
+                yield batches[0]
 
 
 class BaseDataHandler(object):
@@ -17,6 +119,11 @@ class BaseDataHandler(object):
         transformation_dict: dict = None,
         random_state: int = 42,
         drop_last_batch: bool = True,
+        batch_fetch: bool = True,
+        pin_memory: bool = False,
+        persistent_workers: bool = False,
+        prefetch_factor: int = None,
+        resident: bool = False,
     ):
         self.dataset = dataset
         self.batch_size = batch_size
@@ -24,6 +131,68 @@ class BaseDataHandler(object):
         self.transformation_dict = transformation_dict
         self.random_state = random_state
         self.drop_last_batch = drop_last_batch
+        self.batch_fetch = batch_fetch
+        self.pin_memory = pin_memory
+        self.persistent_workers = persistent_workers
+        self.prefetch_factor = prefetch_factor
+        self.resident = resident
+
+    def get_data_loader_kwargs(self) -> dict:
+        data_loader_kwargs = {
+            "num_workers": self.num_workers,
+            "pin_memory": self.pin_memory,
+            "worker_init_fn": seed_worker,
+        }
+        # Worker options are only valid for multi-process loading and are not available in older torch versions.
+        if self.num_workers > 0:
+            supported_kwargs = inspect.signature(DataLoader.__init__).parameters
+            for k, v in [
+                ("persistent_workers", self.persistent_workers),
+                ("prefetch_factor", self.prefetch_factor),
+            ]:
+                if not v:
+                    continue
+                elif k in supported_kwargs:
+                    data_loader_kwargs[k] = v
+                else:
+                    logging.debug(
+                        "DataLoader option {} is not supported by torch {}, ignoring"
+                        " it.".format(k, torch.__version__)
+                    )
+        return data_loader_kwargs
+
+    def get_data_loader(self, dataset: Dataset, sampler: Sampler) -> DataLoader:
+        if self.resident:
+            # Small datasets are kept on the training device for the whole run, batches are sliced from it directly.
+            data_loader = ResidentDataLoader(
+                dataset=dataset,
+                batch_size=self.batch_size,
+                shuffle=isinstance(sampler, RandomSampler),
+                drop_last=self.drop_last_batch,
+                device=get_device(),
+                generator=getattr(sampler, "generator", None),
+            )
+        elif self.batch_fetch and dataset.supports_batch_fetch:
+            # Let the sampler yield the indices of a whole batch such that the dataset can gather it at once and the
+            # per-sample collation is skipped.
+            batch_sampler = BatchSampler(
+                sampler, batch_size=self.batch_size, drop_last=self.drop_last_batch
+            )
+            data_loader = DataLoader(
+                dataset=dataset,
+                batch_size=None,
+                sampler=batch_sampler,
+                **self.get_data_loader_kwargs(),
+            )
+        else:
+            data_loader = DataLoader(
+                dataset=dataset,
+                batch_size=self.batch_size,
+                sampler=sampler,
+                drop_last=self.drop_last_batch,
+                **self.get_data_loader_kwargs(),
+            )
+        return data_loader
 
 
 class DataHandler(BaseDataHandler):
@@ -35,6 +204,11 @@ class DataHandler(BaseDataHandler):
         transformation_dict: dict = None,
         random_state: int = 42,
         drop_last_batch: bool = True,
+        batch_fetch: bool = True,
+        pin_memory: bool = False,
+        persistent_workers: bool = False,
+        prefetch_factor: int = None,
+        resident: bool = False,
     ):
         super().__init__(
             dataset=dataset,
@@ -43,6 +217,11 @@ class DataHandler(BaseDataHandler):
             transformation_dict=transformation_dict,
             random_state=random_state,
             drop_last_batch=drop_last_batch,
+            batch_fetch=batch_fetch,
+            pin_memory=pin_memory,
+            persistent_workers=persistent_workers,
+            prefetch_factor=prefetch_factor,
+            resident=resident,
         )
         self.train_val_test_datasets_dict = None
         self.data_loader_dict = None
@@ -86,14 +265,11 @@ class DataHandler(BaseDataHandler):
                 )
         data_loader_dict = {}
         for k, dataset in self.train_val_test_datasets_dict.items():
-            data_loader_dict[k] = DataLoader(
-                dataset=dataset,
-                batch_size=self.batch_size,
-                shuffle=shuffle and k == "train",
-                num_workers=self.num_workers,
-                drop_last=self.drop_last_batch,
-                worker_init_fn=torch.manual_seed(self.random_state),
-            )
+            if shuffle and k == "train":
+                sampler = RandomSampler(data_source=dataset)
+            else:
+                sampler = SequentialSampler(data_source=dataset)
+            data_loader_dict[k] = self.get_data_loader(dataset=dataset, sampler=sampler)
 
         self.data_loader_dict = data_loader_dict
 
@@ -109,6 +285,11 @@ class DataHandlerCV(BaseDataHandler):
         transformation_dict: dict = None,
         random_state: int = 42,
         drop_last_batch: bool = True,
+        batch_fetch: bool = True,
+        pin_memory: bool = False,
+        persistent_workers: bool = False,
+        prefetch_factor: int = None,
+        resident: bool = False,
     ):
         super().__init__(
             dataset=dataset,
@@ -117,6 +298,11 @@ class DataHandlerCV(BaseDataHandler):
             transformation_dict=transformation_dict,
             random_state=random_state,
             drop_last_batch=drop_last_batch,
+            batch_fetch=batch_fetch,
+            pin_memory=pin_memory,
+            persistent_workers=persistent_workers,
+            prefetch_factor=prefetch_factor,
+            resident=resident,
         )
 
         self.n_folds = n_folds
@@ -181,14 +367,67 @@ class DataHandlerCV(BaseDataHandler):
                     sampler = RandomSampler(data_source=dataset, generator=generator)
                 else:
                     sampler = SequentialSampler(data_source=dataset)
-                data_loader_dict[k] = DataLoader(
-                    dataset=dataset,
-                    batch_size=self.batch_size,
-                    # shuffle=shuffle and k == "train",
-                    sampler=sampler,
-                    num_workers=self.num_workers,
-                    drop_last=self.drop_last_batch,
-                    worker_init_fn=torch.manual_seed(self.random_state),
+                data_loader_dict[k] = self.get_data_loader(
+                    dataset=dataset, sampler=sampler
                 )
 
             self.data_loader_dicts.append(data_loader_dict)
+
+
+class PairedDataHandler(BaseDataHandler):
+    def __init__(
+        self,
+        train_val_test_datasets_dicts: List[dict],
+        batch_size: int = 64,
+        num_workers: int = 0,
+        random_state: int = 42,
+        drop_last_batch: bool = True,
+        batch_fetch: bool = True,
+        pin_memory: bool = False,
+        persistent_workers: bool = False,
+        prefetch_factor: int = None,
+        resident: bool = False,
+    ):
+        super().__init__(
+            dataset=None,
+            batch_size=batch_size,
+            num_workers=num_workers,
+            random_state=random_state,
+            drop_last_batch=drop_last_batch,
+            batch_fetch=batch_fetch,
+            pin_memory=pin_memory,
+            persistent_workers=persistent_workers,
+            prefetch_factor=prefetch_factor,
+            resident=resident,
+        )
+
+        # Joins the train, validation and test splits of the domains into one dataset per split, the domains must
+        # have been split identically.
+        self.train_val_test_datasets_dict = {}
+        for k in train_val_test_datasets_dicts[0]:
+            datasets = [
+                train_val_test_datasets_dict[k]
+                for train_val_test_datasets_dict in train_val_test_datasets_dicts
+            ]
+            for dataset in datasets[1:]:
+                if not np.array_equal(
+                    np.asarray(dataset.indices), np.asarray(datasets[0].indices)
+                ):
+                    raise RuntimeError(
+                        "The {} splits of the paired domains do not contain the same"
+                        " samples.".format(k)
+                    )
+            self.train_val_test_datasets_dict[k] = PairedDataset(datasets=datasets)
+        self.data_loader_dict = None
+
+    def get_data_loader_dict(self, shuffle: bool = True) -> None:
+        data_loader_dict = {}
+        for k, dataset in self.train_val_test_datasets_dict.items():
+            if shuffle and k == "train":
+                generator = torch.Generator().manual_seed(self.random_state)
+                sampler = RandomSampler(data_source=dataset, generator=generator)
+            else:
+                sampler = SequentialSampler(data_source=dataset)
+            data_loader_dict[k] = self.get_data_loader(dataset=dataset, sampler=sampler)
+
+        self.data_loader_dict = data_loader_dict
@@ -0,0 +1,84 @@
+import logging
+from typing import Dict
+
+from torch.nn import Module
+
+from src.helper.checkpoint import CheckpointWriter
+
+
+class EarlyStopping(object):
+    def __init__(
+        self,
+        patience: int,
+        mode: str = "min",
+        smoothing: float = 0.0,
+        min_delta: float = 0.0,
+    ):
+        if mode not in ["min", "max"]:
+            raise NotImplementedError(
+                'Unknown mode "{}", expected one of the following: min, max'.format(
+                    mode
+                )
+            )
+        if not 0.0 <= smoothing < 1.0:
+            raise RuntimeError(
+                "The smoothing factor must be in [0, 1), got {}.".format(smoothing)
+            )
+        self.patience = patience
+        self.mode = mode
+        self.smoothing = smoothing
+        self.min_delta = min_delta
+
+        self.counter = 0
+        self.smoothed_value = None
+        self.best_value = None
+        self.best_epoch = None
+        self.best_states = None
+
+    @property
+    def should_stop(self) -> bool:
+        return self.counter > self.patience
+
+    def is_improvement(self, value: float) -> bool:
+        if self.best_value is None:
+            return True
+        if self.mode == "min":
+            return value < self.best_value - self.min_delta
+        return value > self.best_value + self.min_delta
+
+    def step(self, value: float, epoch: int, modules: Dict[str, Module]) -> bool:
+        # An exponential moving average of the monitored value is less sensitive to the oscillations of the
+        # adversarial training.
+        if self.smoothed_value is None:
+            self.smoothed_value = value
+        else:
+            self.smoothed_value = (
+                self.smoothing * self.smoothed_value + (1 - self.smoothing) * value
+            )
+
+        if not self.is_improvement(self.smoothed_value):
+            self.counter += 1
+            return False
+
+        self.counter = 0
+        self.best_value = self.smoothed_value
+        self.best_epoch = epoch
+        # The best states are kept in memory as copies on the device the modules live on.
+        self.best_states = {
+            name: CheckpointWriter.get_snapshot(module.state_dict())
+            for name, module in modules.items()
+            if module is not None
+        }
+        return True
+
+    def restore(self, modules: Dict[str, Module]):
+        if self.best_states is None:
+            return
+        logging.debug(
+            "Load best model configurations found in epoch {}.".format(
+                self.best_epoch + 1
+            )
+        )
+        for name, module in modules.items():
+            if module is not None:
+                module.load_state_dict(self.best_states[name])
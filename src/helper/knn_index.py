@@ -0,0 +1,173 @@
+import numpy as np
+from numpy import ndarray
+from scipy.spatial.distance import cdist
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.neighbors import NearestNeighbors
+
+try:
+    from pynndescent import NNDescent
+except ImportError:
+    NNDescent = None
+
+
+class KnnIndex(object):
+    def fit(self, samples: ndarray):
+        raise NotImplementedError
+
+    def query(self, samples: ndarray, k: int) -> ndarray:
+        raise NotImplementedError
+
+    @property
+    def is_exact(self) -> bool:
+        return False
+
+
+class ExactKnnIndex(KnnIndex):
+    def __init__(self):
+        self.nn_estimator = None
+
+    def fit(self, samples: ndarray):
+        self.nn_estimator = NearestNeighbors(p=1).fit(samples)
+        return self
+
+    def query(self, samples: ndarray, k: int) -> ndarray:
+        return self.nn_estimator.kneighbors(
+            samples, n_neighbors=k, return_distance=False
+        )
+
+    @property
+    def is_exact(self) -> bool:
+        return True
+
+
+class IVFKnnIndex(KnnIndex):
+    def __init__(
+        self,
+        n_lists: int = None,
+        n_probe: int = 8,
+        n_train_samples_per_list: int = 256,
+        random_state: int = 42,
+    ):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_train_samples_per_list = n_train_samples_per_list
+        self.random_state = random_state
+
+        self.quantizer = None
+        self.samples = None
+        self.sample_idc = None
+        self.list_offsets = None
+
+    def fit(self, samples: ndarray):
+        n_lists = self.n_lists
+        if n_lists is None:
+            n_lists = int(np.sqrt(len(samples)))
+        n_lists = max(1, min(n_lists, len(samples)))
+
+        # The coarse quantizer is trained on a subsample, the cluster structure is well determined by a few hundred
+        # samples per list.
+        random_state = np.random.RandomState(self.random_state)
+        n_train_samples = min(len(samples), n_lists * self.n_train_samples_per_list)
+        train_idc = random_state.choice(len(samples), n_train_samples, replace=False)
+        self.quantizer = MiniBatchKMeans(
+            n_clusters=n_lists, random_state=self.random_state
+        ).fit(samples[train_idc])
+
+        # Samples are stored sorted by their inverted list such that every list is a contiguous block
+        list_idc = self.quantizer.predict(samples)
+        self.sample_idc = np.argsort(list_idc, kind="stable")
+        self.samples = samples[self.sample_idc]
+        self.list_offsets = np.searchsorted(
+            list_idc[self.sample_idc], np.arange(n_lists + 1)
+        )
+        return self
+
+    def query(self, samples: ndarray, k: int) -> ndarray:
+        n_lists = len(self.list_offsets) - 1
+        n_probe = min(self.n_probe, n_lists)
+        centroid_distances = cdist(samples, self.quantizer.cluster_centers_)
+        probe_idc = np.argpartition(centroid_distances, n_probe - 1, axis=1)[
+            :, :n_probe
+        ]
+
+        # Group the queries by the lists they probe
+        probe_idc = probe_idc.ravel()
+        probe_order = np.argsort(probe_idc, kind="stable")
+        probe_query_idc = np.repeat(np.arange(len(samples)), n_probe)[probe_order]
+        probe_offsets = np.searchsorted(probe_idc[probe_order], np.arange(n_lists + 1))
+
+        # The candidates of every list are scored for all queries probing that list at once and merged into the
+        # running top k of these queries. Missing neighbors, i.e. if the probed lists hold less than k samples, are -1.
+        knn_distances = np.full((len(samples), k), np.inf)
+        knn_idc = np.full((len(samples), k), -1, dtype=np.int64)
+        for list_idx in range(n_lists):
+            start, end = self.list_offsets[list_idx], self.list_offsets[list_idx + 1]
+            query_idc = probe_query_idc[
+                probe_offsets[list_idx] : probe_offsets[list_idx + 1]
+            ]
+            if start == end or len(query_idc) == 0:
+                continue
+            distances = np.concatenate(
+                [
+                    knn_distances[query_idc],
+                    cdist(samples[query_idc], self.samples[start:end], "cityblock"),
+                ],
+                axis=1,
+            )
+            idc = np.concatenate(
+                [
+                    knn_idc[query_idc],
+                    np.broadcast_to(
+                        self.sample_idc[start:end], (len(query_idc), end - start)
+                    ),
+                ],
+                axis=1,
+            )
+            top_k = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            knn_distances[query_idc] = np.take_along_axis(distances, top_k, axis=1)
+            knn_idc[query_idc] = np.take_along_axis(idc, top_k, axis=1)
+
+        order = np.argsort(knn_distances, axis=1, kind="stable")
+        return np.take_along_axis(knn_idc, order, axis=1)
+
+
+class NNDescentKnnIndex(KnnIndex):
+    def __init__(
+        self, n_neighbors: int = 30, epsilon: float = 0.1, random_state: int = 42
+    ):
+        if NNDescent is None:
+            raise RuntimeError(
+                "The nndescent backend requires pynndescent, install it with pip"
+                " install pynndescent."
+            )
+        self.n_neighbors = n_neighbors
+        self.epsilon = epsilon
+        self.random_state = random_state
+        self.index = None
+
+    def fit(self, samples: ndarray):
+        self.index = NNDescent(
+            samples,
+            metric="manhattan",
+            n_neighbors=self.n_neighbors,
+            random_state=self.random_state,
+        )
+        return self
+
+    def query(self, samples: ndarray, k: int) -> ndarray:
+        knn_idc, _ = self.index.query(samples, k=k, epsilon=self.epsilon)
+        return knn_idc
+
+
+def get_knn_index(backend: str = "exact", **kwargs) -> KnnIndex:
+    if backend == "exact":
+        return ExactKnnIndex(**kwargs)
+    elif backend == "ivf":
+        return IVFKnnIndex(**kwargs)
+    elif backend == "nndescent":
+        return NNDescentKnnIndex(**kwargs)
+    else:
+        raise NotImplementedError(
+            'Unknown knn backend "{}", expected one of the following: exact, ivf,'
+            " nndescent".format(backend)
+        )
@@ -37,6 +37,7 @@ class DomainConfig(object):
         data_key: str,
         label_key: str,
         train_model: bool = True,
+        batch_transform_dict: dict = None,
     ):
         self.name = name
         self.domain_model_config = DomainModelConfig(
@@ -48,3 +49,9 @@ class DomainConfig(object):
         self.data_loader_dict = data_loader_dict
         self.data_key = data_key
         self.label_key = label_key
+        self.batch_transform_dict = batch_transform_dict
+
+    def get_batch_transform(self, phase: str):
+        if self.batch_transform_dict is None:
+            return None
+        return self.batch_transform_dict.get(phase)
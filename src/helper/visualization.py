@@ -0,0 +1,144 @@
+import copy
+import logging
+import multiprocessing
+from typing import List
+
+import torch
+from torch.nn import Module
+from torch.utils.data import DataLoader
+
+from src.helper.checkpoint import CheckpointWriter
+from src.helper.compiled_module import CompiledModule
+from src.helper.models import DomainConfig
+from src.utils.basic.visualization import visualize_model_performance
+
+
+def get_cpu_model_copy(model: Module) -> Module:
+    # The worker runs compiled models eagerly, only the original model is copied and sent to it.
+    if isinstance(model, CompiledModule):
+        model = model.module
+    return copy.deepcopy(model).cpu()
+
+
+def get_worker_domain_config(
+    domain_config: DomainConfig, dataset_types: List[str]
+) -> DomainConfig:
+    # The worker only needs the datasets of the data loaders, fresh loaders ensure that it never touches the
+    # iterators or worker processes of the training loaders.
+    data_loader_dict = {
+        dataset_type: DataLoader(
+            dataset=domain_config.data_loader_dict[dataset_type].dataset,
+            batch_size=1,
+            shuffle=False,
+        )
+        for dataset_type in dataset_types
+    }
+    return DomainConfig(
+        name=domain_config.name,
+        model=get_cpu_model_copy(domain_config.domain_model_config.model),
+        optimizer=None,
+        recon_loss_function=domain_config.domain_model_config.recon_loss_function,
+        data_loader_dict=data_loader_dict,
+        data_key=domain_config.data_key,
+        label_key=domain_config.label_key,
+    )
+
+
+def run_visualization_worker(
+    task_queue: multiprocessing.Queue,
+    pending_slots: multiprocessing.Semaphore,
+    domain_configs: List[DomainConfig],
+    dataset_types: List[str],
+):
+    while True:
+        task = task_queue.get()
+        if task is None:
+            return
+        output_dir, state_dicts = task
+        try:
+            for domain_config, state_dict in zip(domain_configs, state_dicts):
+                domain_config.domain_model_config.model.load_state_dict(state_dict)
+            visualize_model_performance(
+                output_dir=output_dir,
+                domain_configs=domain_configs,
+                dataset_types=dataset_types,
+                device="cpu",
+            )
+        except Exception as exception:
+            logging.error(
+                "Visualization of the model performance in {} failed: {}".format(
+                    output_dir, exception
+                )
+            )
+        finally:
+            pending_slots.release()
+
+
+class AsyncVisualizationWorker(object):
+    def __init__(
+        self,
+        domain_configs: List[DomainConfig],
+        dataset_types: List[str] = None,
+        max_pending: int = 2,
+        start_method: str = None,
+    ):
+        if dataset_types is None:
+            dataset_types = ["train", "val"]
+        if max_pending < 1:
+            raise RuntimeError(
+                "The maximum number of pending visualizations must be positive, got"
+                " {}.".format(max_pending)
+            )
+        # Forking avoids pickling the datasets but is not safe once CUDA has been initialized in the training process,
+        # in that case the worker is spawned. The worker only ever uses the cpu copies of the models.
+        if start_method is None:
+            if (
+                "fork" in multiprocessing.get_all_start_methods()
+                and not torch.cuda.is_initialized()
+            ):
+                start_method = "fork"
+            else:
+                start_method = "spawn"
+        context = multiprocessing.get_context(start_method)
+
+        self.n_dropped = 0
+        # The number of pending visualizations is bounded by a semaphore that the worker releases once a task is done,
+        # the queue itself is unbounded such that its approximate full and empty states are never relied on
+        self.queue = context.Queue()
+        self.pending_slots = context.Semaphore(max_pending)
+        self.process = context.Process(
+            target=run_visualization_worker,
+            args=(
+                self.queue,
+                self.pending_slots,
+                [
+                    get_worker_domain_config(domain_config, dataset_types)
+                    for domain_config in domain_configs
+                ],
+                dataset_types,
+            ),
+            daemon=True,
+        )
+        self.process.start()
+
+    def submit(self, output_dir: str, domain_configs: List[DomainConfig]):
+        # If the worker falls behind the new visualization is skipped such that training never blocks
+        if not self.pending_slots.acquire(block=False):
+            self.n_dropped += 1
+            logging.debug("Skipped the visualization for {}.".format(output_dir))
+            return
+        # Only cpu copies of the model states are sent to the worker
+        state_dicts = [
+            CheckpointWriter.get_snapshot(
+                domain_config.domain_model_config.model.state_dict(), device="cpu"
+            )
+            for domain_config in domain_configs
+        ]
+        self.queue.put((output_dir, state_dicts))
+
+    def close(self):
+        # Wait for the pending visualizations to be finished
+        if self.process.is_alive():
+            self.queue.put(None)
+            self.process.join()
+        self.queue.close()
@@ -1,5 +1,15 @@
+import hashlib
+import json
+import logging
 import os
-from typing import List
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+from numpy import ndarray
+from skimage import io
+
+SEQ_DATA_CACHE_VERSION = 1
 
 
 def get_file_list(
@@ -65,3 +75,251 @@ def get_model_file_list_for_two_domain_experiment(
     }
 
     return model_locations_dict
+
+
+def get_file_hash(fname: str, block_size: int = 2 ** 20) -> str:
+    file_hash = hashlib.sha1()
+    with open(fname, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def get_seq_data_cache_locs(seq_data_and_labels_fname: str) -> dict:
+    # The cache lives next to the source file, e.g. rna_data.csv -> rna_data.csv.cache/
+    cache_dir = seq_data_and_labels_fname + ".cache"
+    cache_locs = {
+        "cache_dir": cache_dir,
+        "seq_data": os.path.join(cache_dir, "seq_data.npy"),
+        "labels": os.path.join(cache_dir, "labels.npy"),
+        "sample_ids": os.path.join(cache_dir, "sample_ids.npy"),
+        "meta": os.path.join(cache_dir, "meta.json"),
+    }
+    return cache_locs
+
+
+def read_seq_data_and_labels_csv(
+    seq_data_and_labels_fname: str,
+) -> Tuple[ndarray, ndarray, ndarray]:
+    seq_data_and_labels = pd.read_csv(seq_data_and_labels_fname, index_col=0)
+    seq_data = np.ascontiguousarray(
+        np.array(seq_data_and_labels.iloc[:, :-1]).astype(np.float32)
+    )
+    labels = np.array(seq_data_and_labels.iloc[:, -1]).astype(int)
+    sample_ids = np.asarray(seq_data_and_labels.index)
+    if sample_ids.dtype == object:
+        sample_ids = sample_ids.astype(str)
+    return seq_data, labels, sample_ids
+
+
+def is_seq_data_cache_valid(seq_data_and_labels_fname: str) -> bool:
+    cache_locs = get_seq_data_cache_locs(seq_data_and_labels_fname)
+    for k in ["seq_data", "labels", "sample_ids", "meta"]:
+        if not os.path.exists(cache_locs[k]):
+            return False
+    try:
+        with open(cache_locs["meta"], "r") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+
+    if meta.get("version") != SEQ_DATA_CACHE_VERSION:
+        return False
+
+    source_stat = os.stat(seq_data_and_labels_fname)
+    if meta.get("size") != source_stat.st_size:
+        return False
+    if meta.get("mtime_ns") == source_stat.st_mtime_ns:
+        return True
+
+    # The file was touched, only rebuild the cache if its content actually changed.
+    if meta.get("sha1") != get_file_hash(seq_data_and_labels_fname):
+        return False
+    meta["mtime_ns"] = source_stat.st_mtime_ns
+    _write_json_atomic(meta, cache_locs["meta"])
+    return True
+
+
+def _write_json_atomic(data: dict, fname: str):
+    tmp_fname = "{}.{}.tmp".format(fname, os.getpid())
+    with open(tmp_fname, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_fname, fname)
+
+
+def _save_npy_atomic(array: ndarray, fname: str):
+    tmp_fname = "{}.{}.tmp.npy".format(fname[: -len(".npy")], os.getpid())
+    np.save(tmp_fname, array)
+    os.replace(tmp_fname, fname)
+
+
+def build_seq_data_cache(
+    seq_data_and_labels_fname: str,
+) -> Tuple[ndarray, ndarray, ndarray]:
+    source_stat = os.stat(seq_data_and_labels_fname)
+    source_hash = get_file_hash(seq_data_and_labels_fname)
+    seq_data, labels, sample_ids = read_seq_data_and_labels_csv(
+        seq_data_and_labels_fname
+    )
+
+    cache_locs = get_seq_data_cache_locs(seq_data_and_labels_fname)
+    os.makedirs(cache_locs["cache_dir"], exist_ok=True)
+    _save_npy_atomic(seq_data, cache_locs["seq_data"])
+    _save_npy_atomic(labels, cache_locs["labels"])
+    _save_npy_atomic(sample_ids, cache_locs["sample_ids"])
+
+    # The meta data is written last such that an interrupted build is never considered valid.
+    meta = {
+        "version": SEQ_DATA_CACHE_VERSION,
+        "source": os.path.abspath(seq_data_and_labels_fname),
+        "size": source_stat.st_size,
+        "mtime_ns": source_stat.st_mtime_ns,
+        "sha1": source_hash,
+        "shape": list(seq_data.shape),
+    }
+    _write_json_atomic(meta, cache_locs["meta"])
+    logging.debug(
+        "Binary cache for {} written to {}.".format(
+            seq_data_and_labels_fname, cache_locs["cache_dir"]
+        )
+    )
+    return seq_data, labels, sample_ids
+
+
+def load_seq_data_and_labels(
+    seq_data_and_labels_fname: str, use_cache: bool = True, mmap_mode: str = "r"
+) -> Tuple[ndarray, ndarray, ndarray]:
+    if not use_cache:
+        return read_seq_data_and_labels_csv(seq_data_and_labels_fname)
+
+    if not is_seq_data_cache_valid(seq_data_and_labels_fname):
+        logging.debug(
+            "No valid binary cache found for {}, parsing the csv file.".format(
+                seq_data_and_labels_fname
+            )
+        )
+        try:
+            build_seq_data_cache(seq_data_and_labels_fname)
+        except OSError as exception:
+            logging.warning(
+                "Could not write binary cache for {}: {}".format(
+                    seq_data_and_labels_fname, exception
+                )
+            )
+            return read_seq_data_and_labels_csv(seq_data_and_labels_fname)
+
+    cache_locs = get_seq_data_cache_locs(seq_data_and_labels_fname)
+    seq_data = np.load(cache_locs["seq_data"], mmap_mode=mmap_mode)
+    labels = np.load(cache_locs["labels"])
+    sample_ids = np.load(cache_locs["sample_ids"])
+    return seq_data, labels, sample_ids
+
+
+def get_image_store_locs(image_dir: str) -> dict:
+    # The store lives next to the image directory, e.g. images/ -> images.store/
+    store_dir = os.path.normpath(image_dir) + ".store"
+    store_locs = {
+        "store_dir": store_dir,
+        "images": os.path.join(store_dir, "images.npy"),
+        "index": os.path.join(store_dir, "index.csv"),
+    }
+    return store_locs
+
+
+def get_image_index(image_dir: str, image_locs: List[str] = None) -> pd.DataFrame:
+    if image_locs is None:
+        image_locs = get_file_list(image_dir)
+    image_stats = [os.stat(image_loc) for image_loc in image_locs]
+    image_index = pd.DataFrame(
+        {
+            "image_name": [
+                os.path.relpath(image_loc, image_dir) for image_loc in image_locs
+            ],
+            "size": [image_stat.st_size for image_stat in image_stats],
+            "mtime_ns": [image_stat.st_mtime_ns for image_stat in image_stats],
+        }
+    )
+    return image_index
+
+
+def is_image_store_valid(image_dir: str, image_locs: List[str] = None) -> bool:
+    store_locs = get_image_store_locs(image_dir)
+    if not os.path.exists(store_locs["images"]) or not os.path.exists(
+        store_locs["index"]
+    ):
+        return False
+    stored_index = pd.read_csv(store_locs["index"], dtype={"image_name": str})
+    current_index = get_image_index(image_dir=image_dir, image_locs=image_locs)
+    if len(stored_index) != len(current_index):
+        return False
+    return bool(
+        (stored_index.values == current_index.values).all()
+        and list(stored_index.columns) == list(current_index.columns)
+    )
+
+
+def build_image_store(
+    image_dir: str, image_locs: List[str] = None, dtype: str = None
+) -> Tuple[ndarray, List[str]]:
+    if image_locs is None:
+        image_locs = get_file_list(image_dir)
+    if len(image_locs) == 0:
+        raise RuntimeError("No images found in {}.".format(image_dir))
+    image_index = get_image_index(image_dir=image_dir, image_locs=image_locs)
+
+    # Images are stored in their original data type unless specified otherwise, e.g. uint8 crops stay uint8.
+    first_image = np.array(io.imread(image_locs[0]))
+    if dtype is None:
+        dtype = first_image.dtype
+    shape = (len(image_locs), 1) + first_image.shape
+
+    store_locs = get_image_store_locs(image_dir)
+    os.makedirs(store_locs["store_dir"], exist_ok=True)
+    tmp_images_fname = "{}.{}.tmp.npy".format(
+        store_locs["images"][: -len(".npy")], os.getpid()
+    )
+    images = np.lib.format.open_memmap(
+        tmp_images_fname, mode="w+", dtype=dtype, shape=shape
+    )
+    for i, image_loc in enumerate(image_locs):
+        image = np.array(io.imread(image_loc))
+        if image.shape != first_image.shape:
+            raise RuntimeError(
+                "All images must have the same shape to be packed, got {} for {} but"
+                " expected {}.".format(image.shape, image_loc, first_image.shape)
+            )
+        images[i, 0] = image
+    images.flush()
+    del images
+    os.replace(tmp_images_fname, store_locs["images"])
+
+    # The index is written last such that an interrupted build is never considered valid.
+    tmp_index_fname = "{}.{}.tmp".format(store_locs["index"], os.getpid())
+    image_index.to_csv(tmp_index_fname, index=False)
+    os.replace(tmp_index_fname, store_locs["index"])
+    logging.debug(
+        "Packed {} images from {} into {}.".format(
+            len(image_locs), image_dir, store_locs["images"]
+        )
+    )
+    return load_image_store(image_dir)
+
+
+def load_image_store(image_dir: str, mmap_mode: str = "r") -> Tuple[ndarray, List[str]]:
+    store_locs = get_image_store_locs(image_dir)
+    images = np.load(store_locs["images"], mmap_mode=mmap_mode)
+    image_names = list(
+        pd.read_csv(store_locs["index"], dtype={"image_name": str})["image_name"]
+    )
+    return images, image_names
+
+
+def get_image_store(
+    image_dir: str, image_locs: List[str] = None, dtype: str = None
+) -> Tuple[ndarray, List[str]]:
+    if is_image_store_valid(image_dir=image_dir, image_locs=image_locs):
+        return load_image_store(image_dir)
+    logging.debug(
+        "No valid image store found for {}, decoding all images.".format(image_dir)
+    )
+    return build_image_store(image_dir=image_dir, image_locs=image_locs, dtype=dtype)
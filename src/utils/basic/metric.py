@@ -1,19 +1,105 @@
+from typing import List
+
+import numpy as np
 from numpy import ndarray
+from sklearn.metrics import pairwise_distances
 from sklearn.neighbors import NearestNeighbors
 
+from src.helper.knn_index import ExactKnnIndex, KnnIndex
+
+
+def get_paired_knn_ranks(
+    samples_i: ndarray, samples_j: ndarray, k_max: int, knn_index: KnnIndex = None
+) -> ndarray:
+    # Sample k in samples_j is paired with sample k in samples_i. The index is fit and queried once for all rows, the
+    # returned rank is the position of the paired sample among the sorted k_max nearest neighbors or k_max if it is
+    # not among them.
+    if knn_index is None:
+        knn_index = ExactKnnIndex()
+    knn_idc = knn_index.fit(samples_i).query(samples_j, k=k_max)
+    hits = knn_idc == np.arange(len(samples_j)).reshape(-1, 1)
+    return np.where(hits.any(axis=1), hits.argmax(axis=1), k_max)
+
+
+def knn_accuracies(
+    samples_i: ndarray,
+    samples_j: ndarray,
+    n_neighbours: List[int],
+    knn_index: KnnIndex = None,
+) -> dict:
+    ranks = get_paired_knn_ranks(
+        samples_i=samples_i,
+        samples_j=samples_j,
+        k_max=max(n_neighbours),
+        knn_index=knn_index,
+    )
+    return {k: float(np.mean(ranks < k)) for k in n_neighbours}
+
+
+def knn_recall(
+    knn_index: KnnIndex,
+    samples_i: ndarray,
+    samples_j: ndarray,
+    k: int,
+    n_queries: int = 1000,
+    random_state: int = 42,
+) -> float:
+    # Fraction of the exact k nearest neighbors in samples_i that the fitted index returns, estimated on a random
+    # subset of the queries in samples_j for which the exact neighbors are obtained by brute force.
+    random_state = np.random.RandomState(random_state)
+    query_idc = random_state.choice(
+        len(samples_j), min(n_queries, len(samples_j)), replace=False
+    )
+    approximate_knn_idc = knn_index.query(samples_j[query_idc], k=k)
+    nn_estimator = NearestNeighbors(algorithm="brute", p=1).fit(samples_i)
+    exact_knn_idc = nn_estimator.kneighbors(
+        samples_j[query_idc], n_neighbors=k, return_distance=False
+    )
+    n_hits = sum(
+        len(np.intersect1d(approximate_idc, exact_idc))
+        for approximate_idc, exact_idc in zip(approximate_knn_idc, exact_knn_idc)
+    )
+    return n_hits / (len(query_idc) * k)
+
 
 def knn_accuracy(
     samples_i: ndarray, samples_j: ndarray, n_neighbours: int = 5
 ) -> float:
-    nn_estimator = NearestNeighbors(n_neighbors=n_neighbours, p=1)
-    nn_estimator = nn_estimator.fit(samples_i)
-    among_knn = 0
-    for j in range(len(samples_j)):
-        sample_j = samples_j[j]
-        knn_idc = nn_estimator.kneighbors(
-            sample_j.reshape(1, -1), return_distance=False
+    return knn_accuracies(
+        samples_i=samples_i, samples_j=samples_j, n_neighbours=[n_neighbours]
+    )[n_neighbours]
+
+
+def paired_rank_statistics(
+    samples_i: ndarray,
+    samples_j: ndarray,
+    chunk_size: int = 1024,
+    n_queries: int = None,
+    random_state: int = 42,
+) -> dict:
+    # For every sample in samples_j count the samples in samples_i that are closer to it than its paired sample, the
+    # distances are computed in chunks of rows such that the full distance matrix is never materialized. If n_queries
+    # is given the statistics are estimated on a random subset of samples_j, the rank of every query is still exact.
+    n_samples = len(samples_j)
+    if n_queries is not None and n_queries < n_samples:
+        random_state = np.random.RandomState(random_state)
+        query_idc = np.sort(random_state.choice(n_samples, n_queries, replace=False))
+    else:
+        query_idc = np.arange(n_samples)
+    ranks = np.empty(len(query_idc), dtype=np.int64)
+    for start in range(0, len(query_idc), chunk_size):
+        chunk_idc = query_idc[start : start + chunk_size]
+        distances = pairwise_distances(
+            samples_j[chunk_idc], samples_i, metric="manhattan"
+        )
+        paired_distances = distances[np.arange(len(chunk_idc)), chunk_idc]
+        ranks[start : start + chunk_size] = np.sum(
+            distances < paired_distances.reshape(-1, 1), axis=1
         )
-        if j in knn_idc:
-            among_knn += 1
-    knn_acc = among_knn / len(samples_j)
-    return knn_acc
+
+    # FOSCTTM: fraction of samples closer than the true match
+    return {
+        "foscttm": float(np.mean(ranks) / max(n_samples - 1, 1)),
+        "mean_rank": float(np.mean(ranks)),
+        "median_rank": float(np.median(ranks)),
+    }
@@ -14,6 +14,8 @@ def init_nuclei_image_dataset(
     label_fname: str,
     transform_pipeline: Compose = None,
     paired_training_idc: List[int] = None,
+    use_image_store: bool = False,
+    cache_bytes: int = 0,
 ) -> TorchNucleiImageDataset:
     logging.debug(
         "Load images set from {} and label information from {}.".format(
@@ -25,6 +27,8 @@ def init_nuclei_image_dataset(
         label_fname=label_fname,
         transform_pipeline=transform_pipeline,
         paired_training_idc=paired_training_idc,
+        use_image_store=use_image_store,
+        cache_bytes=cache_bytes,
     )
     logging.debug("Samples loaded: {}".format(len(nuclei_dataset)))
     return nuclei_dataset
@@ -34,12 +38,16 @@ def init_seq_dataset(
     seq_data_and_labels_fname: str,
     transform_pipeline: Compose = None,
     paired_training_idc: List[int] = None,
+    use_cache: bool = True,
+    backing_store: str = "memory",
 ):
     logging.debug("Load sequence data set from {}.".format(seq_data_and_labels_fname))
     seq_dataset = TorchSeqDataset(
         seq_data_and_labels_fname=seq_data_and_labels_fname,
         transform_pipeline=transform_pipeline,
         paired_training_idc=paired_training_idc,
+        use_cache=use_cache,
+        backing_store=backing_store,
     )
     logging.debug("Samples loaded: {}".format(len(seq_dataset)))
     return seq_dataset
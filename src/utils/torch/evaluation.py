@@ -1,15 +1,124 @@
+from itertools import chain
 from typing import Tuple, List
 
 import numpy as np
 import torch
 from sklearn.metrics import confusion_matrix
+from torch import Tensor
 from torch.nn import Module
-from torch.utils.data import DataLoader, Dataset
+from torch.utils.data import BatchSampler, DataLoader, Dataset, SequentialSampler
 
 from src.functions.loss_functions import max_discrepancy_loss
+from src.helper.cache import LRUTensorCache
+from src.helper.knn_index import get_knn_index
 from src.helper.models import DomainConfig
 from src.utils.basic.export import dict_to_csv
-from src.utils.basic.metric import knn_accuracy
+from src.utils.basic.metric import knn_accuracies, knn_recall, paired_rank_statistics
+from src.utils.torch.general import get_inference_context
+
+
+def get_inference_data_loader(dataset: Dataset, batch_size: int) -> DataLoader:
+    # Datasets that support it gather a whole batch at once instead of collating it sample by sample
+    if getattr(dataset, "supports_batch_fetch", False):
+        batch_sampler = BatchSampler(
+            SequentialSampler(dataset), batch_size=batch_size, drop_last=False
+        )
+        return DataLoader(dataset=dataset, batch_size=None, sampler=batch_sampler)
+    return DataLoader(dataset=dataset, batch_size=batch_size, shuffle=False)
+
+
+# Latents of a dataset split are shared by all evaluation and plotting consumers as long as the weights of the model
+# are unchanged. The cached tensors live on the inference device, the size of the cache is bounded accordingly.
+latent_cache = LRUTensorCache(max_bytes=2 ** 28)
+
+
+def configure_latent_cache(max_bytes: int):
+    latent_cache.clear()
+    latent_cache.max_bytes = max_bytes
+
+
+def clear_latent_cache():
+    latent_cache.clear()
+
+
+def get_model_version(model: Module) -> tuple:
+    # The version counter of a tensor is incremented by every in-place update, i.e. by optimizer steps, load_state_dict
+    # and the running statistics of batch norm layers, moving the model to another device changes the storages.
+    return tuple(
+        (tensor.data_ptr(), tensor._version)
+        for tensor in chain(model.parameters(), model.buffers())
+    )
+
+
+def get_latents_for_model(
+    model: Module,
+    dataset: Dataset,
+    data_key: str = "seq_data",
+    label_key: str = "label",
+    device: str = "cuda:0",
+    batch_size: int = 128,
+    use_cache: bool = True,
+) -> dict:
+    # There is a single entry per model and dataset, an entry computed for other weights is replaced instead of being
+    # kept until it is evicted.
+    cache_key = (id(model), id(dataset), data_key, str(device))
+    model_version = (get_model_version(model), len(dataset))
+    if use_cache:
+        # Entries that were computed with labels also serve requests without them but not vice versa
+        cached_version, cached_label_key, latent_dict = latent_cache.get(
+            cache_key, (None, None, None)
+        )
+        if cached_version == model_version and label_key in [None, cached_label_key]:
+            if label_key is None:
+                latent_dict = {k: v for k, v in latent_dict.items() if k != "labels"}
+            return latent_dict
+
+    n_samples = len(dataset)
+    training = model.training
+    model.eval().to(device)
+
+    latent_dict = {}
+    start = 0
+    with get_inference_context():
+        for sample in get_inference_data_loader(dataset, batch_size=batch_size):
+            output = model(sample[data_key].to(device))
+            batch_dict = {"shared_latents": output["latents"]}
+            if "unshared_latents" in output:
+                batch_dict["domain_specific_latents"] = output["unshared_latents"]
+            if label_key is not None:
+                batch_dict["labels"] = sample[label_key].to(device)
+
+            end = start + len(output["latents"])
+            for key, value in batch_dict.items():
+                # The output buffers for the whole split are allocated once the shapes are known from the first batch
+                if key not in latent_dict:
+                    latent_dict[key] = torch.empty(
+                        (n_samples,) + tuple(value.shape[1:]),
+                        dtype=value.dtype,
+                        device=device,
+                    )
+                latent_dict[key][start:end] = value
+            start = end
+
+    model.train(training)
+    # The cached tensors are handed out to all consumers which must therefore not modify them in-place.
+    if use_cache:
+        latent_cache.put(cache_key, (model_version, label_key, latent_dict))
+    return latent_dict
+
+
+def get_latent_clf_predictions(
+    latent_clf: Module, latents: Tensor, batch_size: int = 128
+) -> Tensor:
+    training = latent_clf.training
+    latent_clf.eval()
+    with get_inference_context():
+        preds = [
+            torch.max(latent_clf(latents[k : k + batch_size]), dim=1)[1]
+            for k in range(0, len(latents), batch_size)
+        ]
+    latent_clf.train(training)
+    return torch.cat(preds)
 
 
 def evaluate_latent_integration(
@@ -20,6 +129,13 @@ def evaluate_latent_integration(
     data_key_i: str = "seq_data",
     data_key_j: str = "seq_data",
     device: str = "cuda:0",
+    batch_size: int = 128,
+    label_key_i: str = None,
+    label_key_j: str = None,
+    knn_backend: str = "exact",
+    knn_backend_kwargs: dict = None,
+    n_recall_queries: int = 1000,
+    n_foscttm_queries: int = 2000,
 ) -> dict:
     if model_i.model_base_type != model_j.model_base_type:
         raise RuntimeError("Models must be of the same type, i.e. AE/AE or VAE/VAE.")
@@ -29,49 +145,81 @@ def evaluate_latent_integration(
             " k in dataset j."
         )
 
-    # Store batch size to reset it after obtaining the latent representations.
-    single_sample_loader_i = DataLoader(
-        dataset=data_loader_i.dataset, shuffle=False, batch_size=1
-    )
-    single_sample_loader_j = DataLoader(
-        dataset=data_loader_j.dataset, shuffle=False, batch_size=1
-    )
-
-    latents_i = []
-    latents_j = []
-
-    for idx, (samples_i, samples_j) in enumerate(
-        zip(single_sample_loader_i, single_sample_loader_j)
-    ):
-        input_i, input_j = samples_i[data_key_i], samples_j[data_key_j]
-        input_i, input_j = input_i.to(device), input_j.to(device)
-        latent_i = model_i(input_i)["latents"].detach().cpu().numpy()
-        latent_j = model_j(input_j)["latents"].detach().cpu().numpy()
-
-        latents_i.append(latent_i)
-        latents_j.append(latent_j)
+    latents_i = get_latents_for_model(
+        model=model_i,
+        dataset=data_loader_i.dataset,
+        data_key=data_key_i,
+        # Labels are not needed for the metrics but requesting them lets the latents be shared with the visualizations
+        label_key=label_key_i,
+        device=device,
+        batch_size=batch_size,
+    )["shared_latents"]
+    latents_j = get_latents_for_model(
+        model=model_j,
+        dataset=data_loader_j.dataset,
+        data_key=data_key_j,
+        # Labels are not needed for the metrics but requesting them lets the latents be shared with the visualizations
+        label_key=label_key_j,
+        device=device,
+        batch_size=batch_size,
+    )["shared_latents"]
 
     # Compute metrices
-    latents_i = np.array(latents_i).squeeze()
-    latents_j = np.array(latents_j).squeeze()
-    knn_accs = {}
-    for neighbors in [5, 10, 15, 20, 25, 30, 35, 40, 45, 50]:
-        knn_acc = 0.5 * (
-            knn_accuracy(
-                samples_i=latents_i, samples_j=latents_j, n_neighbours=neighbors
+    latent_l1_distance = max_discrepancy_loss(latents_i, latents_j).item()
+
+    latents_i = latents_i.cpu().numpy()
+    latents_j = latents_j.cpu().numpy()
+    # The accuracies for all numbers of neighbors are derived from a single neighbor query per direction
+    n_neighbours = [5, 10, 15, 20, 25, 30, 35, 40, 45, 50]
+    if knn_backend_kwargs is None:
+        knn_backend_kwargs = {}
+    knn_accs_per_direction = []
+    knn_recalls = []
+    for samples_i, samples_j in [(latents_i, latents_j), (latents_j, latents_i)]:
+        knn_index = get_knn_index(knn_backend, **knn_backend_kwargs)
+        knn_accs_per_direction.append(
+            knn_accuracies(
+                samples_i=samples_i,
+                samples_j=samples_j,
+                n_neighbours=n_neighbours,
+                knn_index=knn_index,
             )
-            + knn_accuracy(
-                samples_i=latents_j, samples_j=latents_i, n_neighbours=neighbors
+        )
+        # Approximate indices report their recall against the exact search such that the accuracies stay comparable
+        if not knn_index.is_exact:
+            knn_recalls.append(
+                knn_recall(
+                    knn_index=knn_index,
+                    samples_i=samples_i,
+                    samples_j=samples_j,
+                    k=max(n_neighbours),
+                    n_queries=n_recall_queries,
+                )
             )
+    knn_accs = {}
+    for neighbors in n_neighbours:
+        knn_accs[str(neighbors)] = 0.5 * (
+            knn_accs_per_direction[0][neighbors] + knn_accs_per_direction[1][neighbors]
         )
-        knn_accs[str(neighbors)] = knn_acc
-
-    latent_l1_distance = max_discrepancy_loss(
-        torch.from_numpy(latents_i).to(device), torch.from_numpy(latents_j).to(device)
-    ).item()
-    # latent_l1_distance = torch.nn.L1Loss()(torch.from_numpy(latents_i).to(device), torch.from_numpy(latents_j).to(device))
 
-    metrics = {"knn_accs": knn_accs, "latent_l1_distance": latent_l1_distance}
+    # The FOSCTTM requires the distances between all pairs of samples, with an approximate knn backend it is estimated
+    # on a subset of the samples instead such that it does not dominate the evaluation.
+    n_rank_queries = None if knn_backend == "exact" else n_foscttm_queries
+    rank_statistics_ij = paired_rank_statistics(
+        samples_i=latents_i, samples_j=latents_j, n_queries=n_rank_queries
+    )
+    rank_statistics_ji = paired_rank_statistics(
+        samples_i=latents_j, samples_j=latents_i, n_queries=n_rank_queries
+    )
+    foscttm = 0.5 * (rank_statistics_ij["foscttm"] + rank_statistics_ji["foscttm"])
+
+    metrics = {
+        "knn_accs": knn_accs,
+        "latent_l1_distance": latent_l1_distance,
+        "foscttm": foscttm,
+    }
+    if len(knn_recalls) > 0:
+        metrics["knn_recall"] = float(np.mean(knn_recalls))
     return metrics
 
 
@@ -81,46 +229,18 @@ def get_latent_representations_for_model(
     data_key: str = "seq_data",
     label_key: str = "label",
     device: str = "cuda:0",
+    batch_size: int = 128,
 ) -> dict:
-    # create Dataloader
-    dataloader = DataLoader(dataset=dataset, batch_size=1, shuffle=False)
-
-    shared_latent_representations = []
-    domain_specific_latent_representations = []
-    labels = []
-    model.eval().to(device)
-
-    for (idx, sample) in enumerate(dataloader):
-        input = sample[data_key].to(device)
-        if label_key is not None:
-            labels.append(sample[label_key].item())
-
-        output = model(input)
-        shared_latent_representation = output["latents"]
-        shared_latent_representations.append(
-            shared_latent_representation.detach().cpu().numpy()
-        )
-        # if hasattr(model, "n_latent_spaces") and model.n_latent_spaces == 2:
-        if "unshared_latents" in output:
-            domain_specific_latent_representation = output["unshared_latents"]
-            domain_specific_latent_representations.append(
-                domain_specific_latent_representation.detach().cpu().numpy()
-            )
-
-    shared_latent_representations = np.array(shared_latent_representations).squeeze()
-    domain_specific_latent_representations = np.array(
-        domain_specific_latent_representations
-    ).squeeze()
-    labels = np.array(labels).squeeze()
-
-    latent_dict = {"shared_latents": shared_latent_representations}
-
-    if len(domain_specific_latent_representations) != 0:
-        latent_dict["domain_specific_latents"] = domain_specific_latent_representations
-    if len(labels) != 0:
-        latent_dict["labels"] = labels
-
-    return latent_dict
+    latent_dict = get_latents_for_model(
+        model=model,
+        dataset=dataset,
+        data_key=data_key,
+        label_key=label_key,
+        device=device,
+        batch_size=batch_size,
+    )
+    # Copies are returned such that the arrays can not alias the cached latents
+    return {key: value.cpu().numpy().copy() for key, value in latent_dict.items()}
 
 
 def save_latents_and_labels_to_csv(
@@ -258,32 +378,26 @@ def evaluate_latent_clf_one_domain(
     latent_clf: torch.nn.Module,
     dataset_type: str = "test",
     device: str = "cuda:0",
+    batch_size: int = 128,
 ):
-    model = domain_config.domain_model_config.model.to(device)
+    model = domain_config.domain_model_config.model
     latent_clf.to(device)
 
-    data_key = domain_config.data_key
-    label_key = domain_config.label_key
-
     data_loader = domain_config.data_loader_dict[dataset_type]
-
-    single_sample_loader = DataLoader(
-        dataset=data_loader.dataset, shuffle=False, batch_size=1
+    latent_dict = get_latents_for_model(
+        model=model,
+        dataset=data_loader.dataset,
+        data_key=domain_config.data_key,
+        label_key=domain_config.label_key,
+        device=device,
+        batch_size=batch_size,
     )
-    labels = []
-    preds = []
-
-    for idx, sample in enumerate(single_sample_loader):
-        input = sample[data_key].to(device)
-        label = sample[label_key].to(device)
-        latent = model(input)["latents"]
-        _, pred = torch.max(latent_clf(latent), dim=1)
-
-        labels.append(label.cpu().numpy())
-        preds.append(pred.cpu().detach().numpy())
-    labels = np.array(labels).squeeze()
-    preds = np.array(preds).squeeze()
-    return confusion_matrix(labels, preds)
+    preds = get_latent_clf_predictions(
+        latent_clf=latent_clf,
+        latents=latent_dict["shared_latents"],
+        batch_size=batch_size,
+    )
+    return confusion_matrix(latent_dict["labels"].cpu().numpy(), preds.cpu().numpy())
 
 
 def evaluate_latent_clf_two_domains(
@@ -291,17 +405,12 @@ def evaluate_latent_clf_two_domains(
     latent_clf: torch.nn.Module,
     dataset_type: str = "test",
     device: str = "cuda:0",
+    batch_size: int = 128,
 ):
-    model_i = domain_configs[0].domain_model_config.model.to(device)
-    model_j = domain_configs[1].domain_model_config.model.to(device)
+    model_i = domain_configs[0].domain_model_config.model
+    model_j = domain_configs[1].domain_model_config.model
     latent_clf.to(device)
 
-    data_key_i = domain_configs[0].data_key
-    label_key_i = domain_configs[0].label_key
-
-    data_key_j = domain_configs[1].data_key
-    label_key_j = domain_configs[1].label_key
-
     data_loader_i = domain_configs[0].data_loader_dict[dataset_type]
     data_loader_j = domain_configs[1].data_loader_dict[dataset_type]
 
@@ -313,49 +422,35 @@ def evaluate_latent_clf_two_domains(
             " k in dataset j."
         )
 
-    # Store batch size to reset it after obtaining the latent representations.
-    single_sample_loader_i = DataLoader(
-        dataset=data_loader_i.dataset, shuffle=False, batch_size=1
-    )
-    single_sample_loader_j = DataLoader(
-        dataset=data_loader_j.dataset, shuffle=False, batch_size=1
-    )
-
-    confusion_dict = {}
-    labels_i = []
-    labels_j = []
-    preds_i = []
-    preds_j = []
-
-    for idx, (samples_i, samples_j) in enumerate(
-        zip(single_sample_loader_i, single_sample_loader_j)
+    labels = {}
+    preds = {}
+    for domain_config, model, data_loader in zip(
+        domain_configs, [model_i, model_j], [data_loader_i, data_loader_j]
     ):
-        input_i, input_j = samples_i[data_key_i], samples_j[data_key_j]
-        label_i, label_j = samples_i[label_key_i], samples_j[label_key_j]
-
-        input_i, input_j = input_i.to(device), input_j.to(device)
-        latent_i = model_i(input_i)["latents"]
-        latent_j = model_j(input_j)["latents"]
-
-        _, pred_i = torch.max(latent_clf(latent_i), dim=1)
-        _, pred_j = torch.max(latent_clf(latent_j), dim=1)
-
-        labels_i.append(label_i.cpu().detach().numpy())
-        labels_j.append(label_j.cpu().numpy())
-
-        preds_i.append(pred_i.cpu().detach().numpy())
-        preds_j.append(pred_j.cpu().detach().numpy())
+        latent_dict = get_latents_for_model(
+            model=model,
+            dataset=data_loader.dataset,
+            data_key=domain_config.data_key,
+            label_key=domain_config.label_key,
+            device=device,
+            batch_size=batch_size,
+        )
+        labels[domain_config.name] = latent_dict["labels"].cpu().numpy()
+        preds[domain_config.name] = (
+            get_latent_clf_predictions(
+                latent_clf=latent_clf,
+                latents=latent_dict["shared_latents"],
+                batch_size=batch_size,
+            )
+            .cpu()
+            .numpy()
+        )
 
     # Compute metrices
-    labels_i = np.array(labels_i).squeeze()
-    labels_j = np.array(labels_j).squeeze()
-
-    preds_i = np.array(preds_i).squeeze()
-    preds_j = np.array(preds_j).squeeze()
-
-    confusion_dict[domain_configs[0].name] = confusion_matrix(labels_i, preds_i)
-    confusion_dict[domain_configs[1].name] = confusion_matrix(labels_j, preds_j)
+    confusion_dict = {}
+    for name in labels:
+        confusion_dict[name] = confusion_matrix(labels[name], preds[name])
     confusion_dict["overall"] = confusion_matrix(
-        np.concatenate([labels_i, labels_j]), np.concatenate([preds_i, preds_j])
+        np.concatenate(list(labels.values())), np.concatenate(list(preds.values()))
     )
     return confusion_dict
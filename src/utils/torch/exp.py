@@ -1,4 +1,4 @@
-import copy
+import inspect
 import logging
 import os
 import time
@@ -8,19 +8,136 @@ import numpy as np
 import torch
 from torch import nn, Tensor
 from torch.autograd import Variable
+from torch.cuda.amp import GradScaler
 from torch.nn import Module
 from torch.optim.optimizer import Optimizer
 
-from src.functions.metric import accuracy
+from src.functions.metric import MetricAccumulator, correct_predictions
+from src.helper.checkpoint import CheckpointWriter
+from src.helper.early_stopping import EarlyStopping
+from src.helper.visualization import AsyncVisualizationWorker
 from src.helper.models import DomainModelConfig, DomainConfig
 from src.utils.basic.visualization import visualize_model_performance
-from src.utils.torch.evaluation import evaluate_latent_integration
-from src.utils.torch.general import get_device
+from src.utils.torch.evaluation import (
+    clear_latent_cache,
+    configure_latent_cache,
+    evaluate_latent_integration,
+)
+from src.utils.torch.general import (
+    get_autocast_context,
+    get_device,
+    get_grad_scaler,
+)
+from src.utils.torch.model import get_joint_optimizer
 from src.utils.torch.visualization import (
     visualize_image_translation_performance,
     visualize_image_vae_performance,
 )
 
+# Optimization direction of the metrics that can be monitored for early stopping. The accuracies of the latent
+# discriminator are minimized as lower accuracies correspond to better integrated latent spaces.
+EARLY_STOPPING_METRIC_MODES = {
+    "recon_loss": "min",
+    "total_loss": "min",
+    "ae_dcm_loss": "min",
+    "accuracy_i": "min",
+    "accuracy_j": "min",
+    "kl_loss": "min",
+    "latent_structure_model_loss": "min",
+    "latent_distance_loss": "min",
+    "knn_accuracy": "max",
+    "latent_l1_distance": "min",
+    "foscttm": "min",
+}
+PAIRED_EARLY_STOPPING_METRICS = ["knn_accuracy", "latent_l1_distance", "foscttm"]
+
+
+def set_module_mode(module: Module, train: bool) -> None:
+    # Module.train() recurses over all submodules, skip it if the module already is in the requested mode
+    if module.training != train:
+        module.train(train)
+
+
+def place_modules(modules: List[Module], device: str) -> None:
+    for module in modules:
+        if module is not None:
+            module.to(device)
+
+
+def set_requires_grad(module: Module, requires_grad: bool) -> None:
+    for parameter in module.parameters():
+        parameter.requires_grad_(requires_grad)
+
+
+def supports_backward_inputs() -> bool:
+    # Restricting the backward pass to given tensors is only available from torch 1.8 on
+    return "inputs" in inspect.signature(torch.autograd.backward).parameters
+
+
+def get_ae_optimizers(
+    domain_model_configurations: List[DomainModelConfig],
+    use_latent_structure_model: bool = False,
+    latent_structure_model_optimizer: Optimizer = None,
+    ae_optimizer: Optimizer = None,
+) -> List[Optimizer]:
+    # All trainable models are updated in a single step of the joint optimizer
+    if ae_optimizer is not None:
+        return [ae_optimizer]
+    optimizers = [
+        model_configuration.optimizer
+        for model_configuration in domain_model_configurations
+        if model_configuration.trainable
+    ]
+    if use_latent_structure_model:
+        optimizers.append(latent_structure_model_optimizer)
+    return optimizers
+
+
+def get_optimizer_parameters(optimizers: List[Optimizer]) -> List[Tensor]:
+    return [
+        parameter
+        for optimizer in optimizers
+        for param_group in optimizer.param_groups
+        for parameter in param_group["params"]
+    ]
+
+
+def backward_and_step(
+    loss: Tensor,
+    optimizers: List[Optimizer],
+    grad_scaler: GradScaler = None,
+    loss_scale: float = 1.0,
+    step: bool = True,
+    inputs: List[Tensor] = None,
+    update_grad_scaler: bool = True,
+) -> None:
+    # With gradient accumulation the loss is scaled by the size of the accumulation window and the parameters are only
+    # updated after its last batch
+    if loss_scale != 1.0:
+        loss = loss * loss_scale
+
+    # The gradient scaler is only used for fp16 mixed precision training to avoid underflowing gradients
+    if grad_scaler is not None:
+        loss = grad_scaler.scale(loss)
+    # If inputs are given only their gradients are accumulated
+    if inputs is not None:
+        loss.backward(inputs=inputs)
+    else:
+        loss.backward()
+
+    if grad_scaler is None:
+        if step:
+            for optimizer in optimizers:
+                optimizer.step()
+    else:
+        if step:
+            for optimizer in optimizers:
+                grad_scaler.step(optimizer)
+            # If several updates share the scaler it must only be updated after the last of them such that an inf
+            # found in any of the updates lowers the scale
+            if update_grad_scaler:
+                grad_scaler.update()
+
 
 def train_autoencoders_two_domains(
     domain_model_configurations: List[DomainModelConfig],
@@ -41,6 +158,14 @@ def train_autoencoders_two_domains(
     model_base_type: str = "ae",
     latent_distance_loss: Module = None,
     paired_training_mask: Tensor = None,
+    amp: str = None,
+    grad_scaler: GradScaler = None,
+    zero_grad: bool = True,
+    step: bool = True,
+    loss_scale: float = 1.0,
+    ae_optimizer: Optimizer = None,
+    ae_parameters: List[Tensor] = None,
+    update_grad_scaler: bool = True,
 ) -> dict:
     # Expects 2 model configurations (one for each domain)
     model_configuration_i = domain_model_configurations[0]
@@ -62,257 +187,291 @@ def train_autoencoders_two_domains(
     recon_loss_fct_j = model_configuration_j.recon_loss_function
     train_j = model_configuration_j.trainable
 
-    # Set VAE models to train if defined in respective configuration
-    if phase == "train" and train_i:
-        model_i.train()
-    else:
-        model_i.eval()
-
-    model_i.to(device)
-    optimizer_i.zero_grad()
-
-    if phase == "train" and train_j:
-        model_j.train()
-    else:
-        model_j.eval()
-
-    model_j.to(device)
-    optimizer_j.zero_grad()
-
-    # The discriminator will not be trained but only used to compute the adversarial loss for the AE updates
-    latent_dcm.eval()
-    latent_dcm.to(device)
+    # Set VAE models to train if defined in respective configuration, the models are placed on the device once per
+    # phase by the caller
+    set_module_mode(model_i, train=phase == "train" and train_i)
+    set_module_mode(model_j, train=phase == "train" and train_j)
+
+    # The joint optimizer only holds the parameters of the trainable models
+    if zero_grad:
+        if ae_optimizer is not None:
+            ae_optimizer.zero_grad()
+        if ae_optimizer is None or not train_i:
+            optimizer_i.zero_grad()
+        if ae_optimizer is None or not train_j:
+            optimizer_j.zero_grad()
+
+    # The discriminator will not be trained but only used to compute the adversarial loss for the AE updates, its
+    # gradients must not leak into the gradients accumulated for its own update. The backward pass is restricted to
+    # the parameters of the AE updates if these are given, otherwise the discriminator is frozen for this step.
+    set_module_mode(latent_dcm, train=False)
+    freeze_latent_dcm = phase == "train" and ae_parameters is None
+    if freeze_latent_dcm:
+        set_requires_grad(latent_dcm, False)
 
     if use_latent_structure_model:
         assert latent_structure_model is not None
-        if phase == "train" and latent_structure_model.trainable:
-            latent_structure_model.train()
-        else:
-            latent_structure_model.eval()
-        latent_structure_model.to(device)
-        latent_structure_model_optimizer.zero_grad()
-
-    # Forward pass of the AE/VAE
-    inputs_i, inputs_j = Variable(inputs_i).to(device), Variable(inputs_j).to(device)
-    if labels_i is not None and labels_j is not None:
-        labels_i, labels_j = (
-            Variable(labels_i).to(device),
-            Variable(labels_j).to(device),
+        set_module_mode(
+            latent_structure_model,
+            train=phase == "train" and latent_structure_model.trainable,
+        )
+        if zero_grad and ae_optimizer is None:
+            latent_structure_model_optimizer.zero_grad()
+
+    with get_autocast_context(amp=amp, device=device):
+        # Forward pass of the AE/VAE
+        inputs_i, inputs_j = (
+            Variable(inputs_i).to(device, non_blocking=True),
+            Variable(inputs_j).to(device, non_blocking=True),
         )
+        if labels_i is not None and labels_j is not None:
+            labels_i, labels_j = (
+                Variable(labels_i).to(device, non_blocking=True),
+                Variable(labels_j).to(device, non_blocking=True),
+            )
 
-    outputs_i = model_i(inputs_i)
-    outputs_j = model_j(inputs_j)
+        outputs_i = model_i(inputs_i)
+        outputs_j = model_j(inputs_j)
 
-    recons_i = outputs_i["recons"]
-    recons_j = outputs_j["recons"]
+        recons_i = outputs_i["recons"]
+        recons_j = outputs_j["recons"]
 
-    latents_i = outputs_i["latents"]
-    latents_j = outputs_j["latents"]
+        latents_i = outputs_i["latents"]
+        latents_j = outputs_j["latents"]
 
-    if model_base_type == "vae":
-        mu_i = outputs_i["mu"]
-        mu_j = outputs_j["mu"]
+        if model_base_type == "vae":
+            mu_i = outputs_i["mu"]
+            mu_j = outputs_j["mu"]
 
-        logvar_i = outputs_i["logvar"]
-        logvar_j = outputs_j["logvar"]
+            logvar_i = outputs_i["logvar"]
+            logvar_j = outputs_j["logvar"]
 
-        loss_dict_i = model_i.loss_function(
-            inputs=inputs_i, recons=recons_i, mu=mu_i, logvar=logvar_i
-        )
-        loss_dict_j = model_j.loss_function(
-            inputs=inputs_j, recons=recons_j, mu=mu_j, logvar=logvar_j
-        )
+            loss_dict_i = model_i.loss_function(
+                inputs=inputs_i, recons=recons_i, mu=mu_i, logvar=logvar_i
+            )
+            loss_dict_j = model_j.loss_function(
+                inputs=inputs_j, recons=recons_j, mu=mu_j, logvar=logvar_j
+            )
 
-        recon_loss_i = loss_dict_i["recon_loss"]
-        kld_loss_i = loss_dict_i["kld_loss"]
+            recon_loss_i = loss_dict_i["recon_loss"]
+            kld_loss_i = loss_dict_i["kld_loss"]
 
-        recon_loss_j = loss_dict_j["recon_loss"]
-        kld_loss_j = loss_dict_j["kld_loss"]
+            recon_loss_j = loss_dict_j["recon_loss"]
+            kld_loss_j = loss_dict_j["kld_loss"]
 
-        kl_loss = kld_loss_i + kld_loss_j
-        total_loss = alpha * (recon_loss_i + recon_loss_j) + kl_loss * lamb
-    elif model_base_type == "gmvae":
+            kl_loss = kld_loss_i + kld_loss_j
+            total_loss = alpha * (recon_loss_i + recon_loss_j) + kl_loss * lamb
+        elif model_base_type == "gmvae":
 
-        logits_i = outputs_i["logits"]
-        probs_i = outputs_i["probs"]
-        component_labels_i = outputs_i["component_labels"]
-        mu_i = outputs_i["mu"]
-        logvar_i = outputs_i["logvar"]
-        mu_component_prior_i = outputs_i["mu_component_prior"]
-        logvar_component_prior_i = outputs_i["logvar_component_prior"]
-
-        logits_j = outputs_j["logits"]
-        probs_j = outputs_j["probs"]
-        component_labels_j = outputs_j["component_labels"]
-        mu_j = outputs_j["mu"]
-        logvar_j = outputs_j["logvar"]
-        mu_component_prior_j = outputs_j["mu_component_prior"]
-        logvar_component_prior_j = outputs_j["logvar_component_prior"]
-
-        loss_dict_i = model_i.loss_function(
-            inputs=inputs_i,
-            recons=recons_i,
-            mu=mu_i,
-            logvar=logvar_i,
-            mu_prior=mu_component_prior_i,
-            logvar_prior=logvar_component_prior_i,
-            y_probs=probs_i,
-            y_logits=logits_i,
-            y_true=labels_i,
-        )
+            logits_i = outputs_i["logits"]
+            probs_i = outputs_i["probs"]
+            component_labels_i = outputs_i["component_labels"]
+            mu_i = outputs_i["mu"]
+            logvar_i = outputs_i["logvar"]
+            mu_component_prior_i = outputs_i["mu_component_prior"]
+            logvar_component_prior_i = outputs_i["logvar_component_prior"]
+
+            logits_j = outputs_j["logits"]
+            probs_j = outputs_j["probs"]
+            component_labels_j = outputs_j["component_labels"]
+            mu_j = outputs_j["mu"]
+            logvar_j = outputs_j["logvar"]
+            mu_component_prior_j = outputs_j["mu_component_prior"]
+            logvar_component_prior_j = outputs_j["logvar_component_prior"]
+
+            loss_dict_i = model_i.loss_function(
+                inputs=inputs_i,
+                recons=recons_i,
+                mu=mu_i,
+                logvar=logvar_i,
+                mu_prior=mu_component_prior_i,
+                logvar_prior=logvar_component_prior_i,
+                y_probs=probs_i,
+                y_logits=logits_i,
+                y_true=labels_i,
+            )
 
-        loss_dict_j = model_j.loss_function(
-            inputs=inputs_j,
-            recons=recons_j,
-            mu=mu_j,
-            logvar=logvar_j,
-            mu_prior=mu_component_prior_j,
-            logvar_prior=logvar_component_prior_j,
-            y_probs=probs_j,
-            y_logits=logits_j,
-            y_true=labels_j,
-        )
+            loss_dict_j = model_j.loss_function(
+                inputs=inputs_j,
+                recons=recons_j,
+                mu=mu_j,
+                logvar=logvar_j,
+                mu_prior=mu_component_prior_j,
+                logvar_prior=logvar_component_prior_j,
+                y_probs=probs_j,
+                y_logits=logits_j,
+                y_true=labels_j,
+            )
 
-        recon_loss_i = loss_dict_i["recon_loss"]
-        kld_loss_i = loss_dict_i["kld_loss"]
-        component_prior_loss_i = loss_dict_i["component_prior_loss"]
-        component_supervision_loss_i = loss_dict_i["component_supervision_loss"]
+            recon_loss_i = loss_dict_i["recon_loss"]
+            kld_loss_i = loss_dict_i["kld_loss"]
+            component_prior_loss_i = loss_dict_i["component_prior_loss"]
+            component_supervision_loss_i = loss_dict_i["component_supervision_loss"]
+
+            recon_loss_j = loss_dict_j["recon_loss"]
+            kld_loss_j = loss_dict_j["kld_loss"]
+            component_prior_loss_j = loss_dict_j["component_prior_loss"]
+            component_supervision_loss_j = loss_dict_j["component_supervision_loss"]
+
+            kl_loss = kld_loss_i + kld_loss_j
+
+            total_loss = alpha * (recon_loss_i + recon_loss_j) + lamb * kl_loss
+            if (
+                component_prior_loss_i is not None
+                and component_prior_loss_j is not None
+            ):
+                total_loss += component_prior_loss_i + component_prior_loss_j
+            elif (
+                component_supervision_loss_i is not None
+                and component_supervision_loss_j is not None
+            ):
+                total_loss += (
+                    component_supervision_loss_i + component_supervision_loss_j
+                )
 
-        recon_loss_j = loss_dict_j["recon_loss"]
-        kld_loss_j = loss_dict_j["kld_loss"]
-        component_prior_loss_j = loss_dict_j["component_prior_loss"]
-        component_supervision_loss_j = loss_dict_j["component_supervision_loss"]
+        elif model_base_type == "ae":
+            recon_loss_i = model_i.loss_function(inputs=inputs_i, recons=recons_i)[
+                "recon_loss"
+            ]
+            recon_loss_j = model_j.loss_function(inputs=inputs_j, recons=recons_j)[
+                "recon_loss"
+            ]
+            total_loss = alpha * (recon_loss_i + recon_loss_j)
+        else:
+            raise RuntimeError("Unknown model type: {}".format(model_base_type))
 
-        kl_loss = kld_loss_i + kld_loss_j
+        if use_latent_discriminator:
 
-        total_loss = alpha * (recon_loss_i + recon_loss_j) + lamb * kl_loss
-        if component_prior_loss_i is not None and component_prior_loss_j is not None:
-            total_loss += component_prior_loss_i + component_prior_loss_j
-        elif (
-            component_supervision_loss_i is not None
-            and component_supervision_loss_j is not None
-        ):
-            total_loss += component_supervision_loss_i + component_supervision_loss_j
+            # Add class label to latent representations to ensure that latent representations encode generic information
+            # independent from the used group of the samples (see Adversarial AutoEncoder paper)
+            dcm_input_i = torch.cat(
+                (latents_i, labels_i.float().view(-1, 1).expand(-1, 5)), dim=1
+            )
+            dcm_input_j = torch.cat(
+                (latents_j, labels_j.float().view(-1, 1).expand(-1, 5)), dim=1
+            )
 
-    elif model_base_type == "ae":
-        recon_loss_i = model_i.loss_function(inputs=inputs_i, recons=recons_i)[
-            "recon_loss"
-        ]
-        recon_loss_j = model_j.loss_function(inputs=inputs_j, recons=recons_j)[
-            "recon_loss"
-        ]
-        total_loss = alpha * (recon_loss_i + recon_loss_j)
-    else:
-        raise RuntimeError("Unknown model type: {}".format(model_base_type))
+        else:
+            dcm_input_i = latents_i
+            dcm_input_j = latents_j
 
-    if use_latent_discriminator:
+        dcm_output_i = latent_dcm(dcm_input_i)
+        dcm_output_j = latent_dcm(dcm_input_j)
 
-        # Add class label to latent representations to ensure that latent representations encode generic information
-        # independent from the used group of the samples (see Adversarial AutoEncoder paper)
-        dcm_input_i = torch.cat(
-            (latents_i, labels_i.float().view(-1, 1).expand(-1, 5)), dim=1
+        domain_labels_i = torch.zeros(
+            dcm_output_i.size(0), dtype=torch.long, device=dcm_output_i.device
         )
-        dcm_input_j = torch.cat(
-            (latents_j, labels_j.float().view(-1, 1).expand(-1, 5)), dim=1
+        domain_labels_j = torch.ones(
+            dcm_output_j.size(0), dtype=torch.long, device=dcm_output_j.device
         )
+        # domain_labels_i = (
+        #     torch.ones(dcm_output_i.size(0)).float().to(device).view(-1, 1) * 0.1
+        # )
+        # domain_labels_j = (
+        #     torch.ones(dcm_output_j.size(0)).float().to(device).view(-1, 1) * 0.9
+        # )
+
+        # Forward pass latent structure model if it is supposed to be trained and used to assess the integration of the learned
+        # latent spaces
+        if use_latent_structure_model:
+            latent_structure_model_output_i = latent_structure_model(latents_i)
+            latent_structure_model_output_j = latent_structure_model(latents_j)
 
-    else:
-        dcm_input_i = latents_i
-        dcm_input_j = latents_j
-
-    dcm_output_i = latent_dcm(dcm_input_i)
-    dcm_output_j = latent_dcm(dcm_input_j)
-
-    domain_labels_i = torch.zeros(dcm_output_i.size(0)).long().to(device)
-    domain_labels_j = torch.ones(dcm_output_j.size(0)).long().to(device)
-    # domain_labels_i = (
-    #     torch.ones(dcm_output_i.size(0)).float().to(device).view(-1, 1) * 0.1
-    # )
-    # domain_labels_j = (
-    #     torch.ones(dcm_output_j.size(0)).float().to(device).view(-1, 1) * 0.9
-    # )
-
-    # Forward pass latent structure model if it is supposed to be trained and used to assess the integration of the learned
-    # latent spaces
-    if use_latent_structure_model:
-        latent_structure_model_output_i = latent_structure_model(latents_i)
-        latent_structure_model_output_j = latent_structure_model(latents_j)
-
-    # Calculate adversarial loss - by mixing labels indicating domain with output predictions to "confuse" the
-    # discriminator and encourage learning autoencoder that make the distinction between the modalities in the latent
-    # space as difficult as possible for the discriminator
-
-    dcm_loss = 0.5 * latent_dcm_loss(
-        dcm_output_i, domain_labels_j
-    ) + 0.5 * latent_dcm_loss(dcm_output_j, domain_labels_i)
+        # Calculate adversarial loss - by mixing labels indicating domain with output predictions to "confuse" the
+        # discriminator and encourage learning autoencoder that make the distinction between the modalities in the latent
+        # space as difficult as possible for the discriminator
 
-    total_loss += dcm_loss * beta
+        dcm_loss = 0.5 * latent_dcm_loss(
+            dcm_output_i, domain_labels_j
+        ) + 0.5 * latent_dcm_loss(dcm_output_j, domain_labels_i)
 
-    # Add loss of latent structure model if this is trained
-    if use_latent_structure_model:
-        latent_sm_loss = 0.5 * (
-            latent_structure_model_loss(latent_structure_model_output_i, labels_i)
-            + latent_structure_model_loss(latent_structure_model_output_j, labels_j)
-        )
-        total_loss += latent_sm_loss * gamma
+        total_loss += dcm_loss * beta
 
-    # Add loss measuring the distance between a pair of samples in the latent space if this is desired
-    # Be careful using this option as it is important that the samples in the batch are actually paired
-    if paired_training_mask is not None:
-        paired_distance_samples = paired_training_mask.sum().item()
-        if paired_distance_samples > 0:
-            paired_supervision_loss = latent_distance_loss(
-                latents_i[paired_training_mask], latents_j[paired_training_mask]
+        # Add loss of latent structure model if this is trained
+        if use_latent_structure_model:
+            latent_sm_loss = 0.5 * (
+                latent_structure_model_loss(latent_structure_model_output_i, labels_i)
+                + latent_structure_model_loss(latent_structure_model_output_j, labels_j)
+            )
+            total_loss += latent_sm_loss * gamma
+
+        # Add loss measuring the distance between a pair of samples in the latent space if this is desired
+        # Be careful using this option as it is important that the samples in the batch are actually paired
+        if paired_training_mask is not None:
+            paired_training_mask = paired_training_mask.to(device, non_blocking=True)
+            paired_distance_samples = paired_training_mask.sum()
+
+            # Unpaired samples are zeroed out and the mean is rescaled to the paired samples instead of indexing with the
+            # mask, which would require the number of paired samples on the host. Batches without pairs contribute 0.
+            pair_weights = paired_training_mask.view(-1, 1).to(latents_i.dtype)
+            paired_supervision_loss = (
+                latent_distance_loss(latents_i * pair_weights, latents_j * pair_weights)
+                * paired_training_mask.size(0)
+                / paired_distance_samples.clamp(min=1)
             )
             total_loss += paired_supervision_loss * delta
-        else:
-            paired_supervision_loss = 0
 
     # Backpropagate loss and update parameters if we are in the training phase
     if phase == "train":
-        total_loss.backward()
         if train_i:
-            optimizer_i.step()
             model_i.updated = True
         if train_j:
-            optimizer_j.step()
             model_j.updated = True
-        if use_latent_structure_model:
-            latent_structure_model_optimizer.step()
+        optimizers = get_ae_optimizers(
+            domain_model_configurations=domain_model_configurations,
+            use_latent_structure_model=use_latent_structure_model,
+            latent_structure_model_optimizer=latent_structure_model_optimizer,
+            ae_optimizer=ae_optimizer,
+        )
+        backward_and_step(
+            loss=total_loss,
+            optimizers=optimizers,
+            grad_scaler=grad_scaler,
+            loss_scale=loss_scale,
+            step=step,
+            inputs=ae_parameters,
+            update_grad_scaler=update_grad_scaler,
+        )
+    if freeze_latent_dcm:
+        set_requires_grad(latent_dcm, True)
 
-    # Get summary statistics
+    # Get summary statistics, these are kept as detached tensors on the device and accumulated by the caller
     batch_size_i = inputs_i.size(0)
     batch_size_j = inputs_j.size(0)
     summary_stats = {
-        "recon_loss_i": recon_loss_i.item() * batch_size_i,
-        "recon_loss_j": recon_loss_j.item() * batch_size_j,
-        "dcm_loss": dcm_loss.item() * (batch_size_i + batch_size_j),
+        "recon_loss_i": recon_loss_i.detach() * batch_size_i,
+        "recon_loss_j": recon_loss_j.detach() * batch_size_j,
+        "dcm_loss": dcm_loss.detach() * (batch_size_i + batch_size_j),
     }
     total_loss_item = (
         alpha * (summary_stats["recon_loss_i"] + summary_stats["recon_loss_j"])
         + summary_stats["dcm_loss"] * beta
     )
     if model_base_type == "vae":
-        summary_stats["kl_loss"] = kl_loss.item()
-        total_loss_item += kl_loss.item() * lamb
+        summary_stats["kl_loss"] = kl_loss.detach()
+        total_loss_item += kl_loss.detach() * lamb
     elif model_base_type == "gmvae":
-        summary_stats["kl_loss"] = kl_loss.item()
-        total_loss_item = total_loss.item()
+        summary_stats["kl_loss"] = kl_loss.detach()
+        total_loss_item = total_loss.detach()
 
     if use_latent_structure_model:
-        summary_stats["latent_structure_model_loss"] = latent_sm_loss.item() * (
+        summary_stats["latent_structure_model_loss"] = latent_sm_loss.detach() * (
             batch_size_i + batch_size_j
         )
         total_loss_item += summary_stats["latent_structure_model_loss"] * gamma
 
-    if paired_training_mask is not None and paired_distance_samples > 0:
+    if paired_training_mask is not None:
         summary_stats["latent_distance_loss"] = (
-            paired_supervision_loss.item() * paired_distance_samples
+            paired_supervision_loss.detach() * paired_distance_samples
         )
         summary_stats["paired_distance_samples"] = paired_distance_samples
 
     summary_stats["total_loss"] = total_loss_item
 
+    # Hand out the latents of this forward pass such that the discriminator update does not need to recompute them
+    summary_stats["latents_i"] = latents_i.detach()
+    summary_stats["latents_j"] = latents_j.detach()
+
     return summary_stats
 
 
@@ -324,6 +483,13 @@ def train_latent_dcm_two_domains(
     use_latent_discriminator: bool,
     device: str = "cuda:0",
     phase: str = "train",
+    latents_i: Tensor = None,
+    latents_j: Tensor = None,
+    amp: str = None,
+    grad_scaler: GradScaler = None,
+    zero_grad: bool = True,
+    step: bool = True,
+    loss_scale: float = 1.0,
 ) -> dict:
     # Get the model configurations for the two domains
     model_configuration_i = domain_model_configurations[0]
@@ -339,82 +505,88 @@ def train_latent_dcm_two_domains(
     inputs_j = model_configuration_j.inputs
     labels_j = model_configuration_j.labels
 
-    # Set VAE models to eval for the training of the discriminator
-    model_i.eval()
-    model_j.eval()
-
-    # Send models and data to device
-    inputs_i, inputs_j = Variable(inputs_i).to(device), Variable(inputs_j).to(device)
-
-    model_i.to(device)
-    model_j.to(device)
+    # Send data to device, the models are placed on the device once per phase by the caller
+    inputs_i, inputs_j = (
+        Variable(inputs_i).to(device, non_blocking=True),
+        Variable(inputs_j).to(device, non_blocking=True),
+    )
 
     # Set latent discriminator to train
-    if phase == "train" and latent_dcm.train:
-        latent_dcm.train()
-    else:
-        latent_dcm.eval()
+    set_module_mode(latent_dcm, train=phase == "train")
+
+    # Reset the gradients of the discriminator
+    if zero_grad:
+        latent_dcm_optimizer.zero_grad()
+
+    with get_autocast_context(amp=amp, device=device):
+        # Forward pass, the latents are only inputs of the discriminator so no graph is built for the autoencoders
+        if latents_i is None or latents_j is None:
+            # Set VAE models to eval for the training of the discriminator
+            set_module_mode(model_i, train=False)
+            set_module_mode(model_j, train=False)
+            with torch.no_grad():
+                latents_i = model_i(inputs_i)["latents"]
+                latents_j = model_j(inputs_j)["latents"]
+
+        if use_latent_discriminator:
+            labels_i, labels_j = (
+                Variable(labels_i).to(device, non_blocking=True),
+                Variable(labels_j).to(device, non_blocking=True),
+            )
 
-    # Send the discriminator to the device and reset the parameters if in phase train
-    latent_dcm.to(device)
-    latent_dcm_optimizer.zero_grad()
+            # Add class label to latent representations to ensure that latent representations encode generic information
+            # independent from the used data modality (see Adversarial AutoEncoder paper)
+            dcm_input_i = torch.cat(
+                (latents_i, labels_i.float().view(-1, 1).expand(-1, 5)), dim=1
+            )
+            dcm_input_j = torch.cat(
+                (latents_j, labels_j.float().view(-1, 1).expand(-1, 5)), dim=1
+            )
 
-    # Forward pass
-    latents_i = Variable(model_i(inputs_i)["latents"])
-    latents_j = Variable(model_j(inputs_j)["latents"])
+        else:
+            dcm_input_i = latents_i
+            dcm_input_j = latents_j
 
-    if use_latent_discriminator:
-        labels_i, labels_j = (
-            Variable(labels_i).to(device),
-            Variable(labels_j).to(device),
-        )
+        dcm_output_i = latent_dcm(dcm_input_i)
+        dcm_output_j = latent_dcm(dcm_input_j)
 
-        # Add class label to latent representations to ensure that latent representations encode generic information
-        # independent from the used data modality (see Adversarial AutoEncoder paper)
-        dcm_input_i = torch.cat(
-            (latents_i, labels_i.float().view(-1, 1).expand(-1, 5)), dim=1
+        domain_labels_i = torch.zeros(
+            dcm_output_i.size(0), dtype=torch.long, device=dcm_output_i.device
         )
-        dcm_input_j = torch.cat(
-            (latents_j, labels_j.float().view(-1, 1).expand(-1, 5)), dim=1
+        domain_labels_j = torch.ones(
+            dcm_output_j.size(0), dtype=torch.long, device=dcm_output_j.device
+        )
+        # domain_labels_i = (
+        #     torch.ones(dcm_output_i.size(0)).long().to(device).view(-1, 1) * 0.1
+        # )
+        # domain_labels_j = (
+        #     torch.ones(dcm_output_j.size(0)).long().to(device).view(-1, 1) * 0.9
+        # )
+
+        dcm_loss = 0.5 * (
+            latent_dcm_loss(dcm_output_i, domain_labels_i)
+            + latent_dcm_loss(dcm_output_j, domain_labels_j)
         )
-
-    else:
-        dcm_input_i = latents_i
-        dcm_input_j = latents_j
-
-    dcm_output_i = latent_dcm(dcm_input_i)
-    dcm_output_j = latent_dcm(dcm_input_j)
-
-    domain_labels_i = torch.zeros(dcm_output_i.size(0)).long().to(device)
-    domain_labels_j = torch.ones(dcm_output_j.size(0)).long().to(device)
-    # domain_labels_i = (
-    #     torch.ones(dcm_output_i.size(0)).long().to(device).view(-1, 1) * 0.1
-    # )
-    # domain_labels_j = (
-    #     torch.ones(dcm_output_j.size(0)).long().to(device).view(-1, 1) * 0.9
-    # )
-
-    dcm_loss = 0.5 * (
-        latent_dcm_loss(dcm_output_i, domain_labels_i)
-        + latent_dcm_loss(dcm_output_j, domain_labels_j)
-    )
 
     # Backpropagate loss and update parameters if in phase 'train'
     if phase == "train":
-        dcm_loss.backward()
-        latent_dcm_optimizer.step()
-    else:
-        pass
+        backward_and_step(
+            loss=dcm_loss,
+            optimizers=[latent_dcm_optimizer],
+            grad_scaler=grad_scaler,
+            loss_scale=loss_scale,
+            step=step,
+        )
 
     # Get summary statistics
     batch_size_i = inputs_i.size(0)
     batch_size_j = inputs_j.size(0)
 
-    accuracy_i = accuracy(dcm_output_i, domain_labels_i)
-    accuracy_j = accuracy(dcm_output_j, domain_labels_j)
+    accuracy_i = correct_predictions(dcm_output_i, domain_labels_i)
+    accuracy_j = correct_predictions(dcm_output_j, domain_labels_j)
 
     summary_stats = {
-        "dcm_loss": dcm_loss.item() * (batch_size_i + batch_size_j),
+        "dcm_loss": dcm_loss.detach() * (batch_size_i + batch_size_j),
         "accuracy_i": accuracy_i,
         "accuracy_j": accuracy_j,
     }
@@ -422,6 +594,17 @@ def train_latent_dcm_two_domains(
     return summary_stats
 
 
+def get_batch_inputs(
+    domain_config: DomainConfig, samples: dict, phase: str, device: str
+) -> Tensor:
+    inputs = samples[domain_config.data_key]
+    batch_transform = domain_config.get_batch_transform(phase)
+    if batch_transform is not None:
+        # Augment the collated batch on the training device instead of per sample in the data loader
+        inputs = batch_transform(inputs.to(device, non_blocking=True))
+    return inputs
+
+
 def process_epoch_two_domains(
     domain_configs: List[DomainConfig],
     latent_dcm: Module,
@@ -440,37 +623,30 @@ def process_epoch_two_domains(
     use_latent_structure_model: bool = False,
     phase: str = "train",
     device: str = "cuda:0",
+    paired_data_loader_dict: dict = None,
+    share_encoder_forward: bool = False,
+    amp: str = None,
+    grad_scaler: GradScaler = None,
+    accumulation_steps: int = 1,
+    ae_optimizer: Optimizer = None,
 ) -> dict:
     # Get domain configurations for the two domains
     domain_config_i = domain_configs[0]
     domain_model_config_i = domain_config_i.domain_model_config
     data_loader_dict_i = domain_config_i.data_loader_dict
     train_loader_i = data_loader_dict_i[phase]
-    data_key_i = domain_config_i.data_key
     label_key_i = domain_config_i.label_key
 
     domain_config_j = domain_configs[1]
     domain_model_config_j = domain_config_j.domain_model_config
     data_loader_dict_j = domain_config_j.data_loader_dict
     train_loader_j = data_loader_dict_j[phase]
-    data_key_j = domain_config_j.data_key
     label_key_j = domain_config_j.label_key
 
-    # Initialize epoch statistics
-    recon_loss_i = 0
-    recon_loss_j = 0
-    dcm_loss = 0
-    latent_sm_loss = 0
-    ae_dcm_loss = 0
-    kl_loss = 0
-    distance_loss = 0
-    total_loss = 0
-
-    correct_preds_i = 0
+    # Initialize epoch statistics, the losses are summed on the device and read back once at the end of the epoch
+    epoch_sums = MetricAccumulator()
     n_preds_i = 0
-    correct_preds_j = 0
     n_preds_j = 0
-    paired_distance_samples = 0
 
     if (
         domain_model_config_i.model.model_base_type
@@ -488,18 +664,68 @@ def process_epoch_two_domains(
 
     # partly_integrated_latent_space = domain_model_config_i.model.n_latent_spaces == 2
 
+    # Place all models on the device once per phase instead of once per batch
+    place_modules(
+        [
+            domain_model_config_i.model,
+            domain_model_config_j.model,
+            latent_dcm,
+            latent_structure_model if use_latent_structure_model else None,
+        ],
+        device=device,
+    )
+
+    # The AE updates only compute the gradients of the parameters they update such that the discriminator does not
+    # have to be frozen and unfrozen for every batch
+    if phase == "train" and supports_backward_inputs():
+        ae_parameters = get_optimizer_parameters(
+            get_ae_optimizers(
+                domain_model_configurations=[
+                    domain_model_config_i,
+                    domain_model_config_j,
+                ],
+                use_latent_structure_model=use_latent_structure_model,
+                latent_structure_model_optimizer=latent_structure_model_optimizer,
+                ae_optimizer=ae_optimizer,
+            )
+        )
+    else:
+        ae_parameters = None
+
+    # Paired data is served by a joint loader that yields index-aligned batches of both domains
+    if paired_data_loader_dict is not None:
+        batches = paired_data_loader_dict[phase]
+        n_batches = len(batches)
+    else:
+        batches = zip(train_loader_i, train_loader_j)
+        n_batches = min(len(train_loader_i), len(train_loader_j))
+
     # Iterate over batches
-    for index, (samples_i, samples_j) in enumerate(zip(train_loader_i, train_loader_j)):
+    for index, (samples_i, samples_j) in enumerate(batches):
+        # Gradients are accumulated over windows of accumulation_steps batches (the last window of an epoch might be
+        # smaller), the AEs and the discriminator are updated alternately once per window
+        window_start = index - index % accumulation_steps
+        window_size = min(accumulation_steps, n_batches - window_start)
+        zero_grad = index == window_start
+        step = index == window_start + window_size - 1
+        loss_scale = 1.0 / window_size
+
         # Set model_configs
-        domain_model_config_i.inputs = samples_i[data_key_i]
+        domain_model_config_i.inputs = get_batch_inputs(
+            domain_config=domain_config_i, samples=samples_i, phase=phase, device=device
+        )
         domain_model_config_i.labels = samples_i[label_key_i]
 
-        domain_model_config_j.inputs = samples_j[data_key_j]
+        domain_model_config_j.inputs = get_batch_inputs(
+            domain_config=domain_config_j, samples=samples_j, phase=phase, device=device
+        )
         domain_model_config_j.labels = samples_j[label_key_j]
 
         if "train_pair" in samples_i and "train_pair" in samples_j:
             paired_training_mask = samples_i["train_pair"]
-            if not torch.all(torch.eq(paired_training_mask, samples_j["train_pair"])):
+            if paired_data_loader_dict is None and not torch.all(
+                torch.eq(paired_training_mask, samples_j["train_pair"])
+            ):
                 raise RuntimeError("Samples seemed to be not aligned!")
         else:
             paired_training_mask = None
@@ -525,27 +751,40 @@ def process_epoch_two_domains(
             model_base_type=model_base_type,
             latent_distance_loss=latent_distance_loss,
             paired_training_mask=paired_training_mask,
+            amp=amp,
+            grad_scaler=grad_scaler,
+            zero_grad=zero_grad,
+            step=step,
+            loss_scale=loss_scale,
+            ae_optimizer=ae_optimizer,
+            ae_parameters=ae_parameters,
+            # The AEs and the discriminator share the gradient scaler, it is updated once after the discriminator step
+            update_grad_scaler=False,
         )
         # Update statistics after training the AE
-        recon_loss_i += ae_train_summary["recon_loss_i"]
-        recon_loss_j += ae_train_summary["recon_loss_j"]
-        ae_dcm_loss += ae_train_summary["dcm_loss"]
-        total_loss += ae_train_summary["total_loss"]
+        epoch_sums.add("recon_loss_i", ae_train_summary["recon_loss_i"])
+        epoch_sums.add("recon_loss_j", ae_train_summary["recon_loss_j"])
+        epoch_sums.add("ae_dcm_loss", ae_train_summary["dcm_loss"])
+        epoch_sums.add("total_loss", ae_train_summary["total_loss"])
 
         if (
             paired_training_mask is not None
             and "latent_distance_loss" in ae_train_summary
         ):
-            distance_loss += ae_train_summary["latent_distance_loss"]
-            paired_distance_samples += ae_train_summary["paired_distance_samples"]
+            epoch_sums.add("distance_loss", ae_train_summary["latent_distance_loss"])
+            epoch_sums.add(
+                "paired_distance_samples", ae_train_summary["paired_distance_samples"]
+            )
 
         if model_base_type == "vae":
-            kl_loss += ae_train_summary["kl_loss"]
+            epoch_sums.add("kl_loss", ae_train_summary["kl_loss"])
         elif model_base_type == "gmvae":
-            kl_loss += ae_train_summary["kl_loss"]
+            epoch_sums.add("kl_loss", ae_train_summary["kl_loss"])
 
         if use_latent_structure_model:
-            latent_sm_loss += ae_train_summary["latent_structure_model_loss"]
+            epoch_sums.add(
+                "latent_sm_loss", ae_train_summary["latent_structure_model_loss"]
+            )
 
         dcm_train_summary = train_latent_dcm_two_domains(
             domain_model_configurations=domain_model_configs,
@@ -555,15 +794,36 @@ def process_epoch_two_domains(
             use_latent_discriminator=use_latent_discriminator,
             phase=phase,
             device=device,
+            latents_i=ae_train_summary["latents_i"] if share_encoder_forward else None,
+            latents_j=ae_train_summary["latents_j"] if share_encoder_forward else None,
+            amp=amp,
+            grad_scaler=grad_scaler,
+            zero_grad=zero_grad,
+            step=step,
+            loss_scale=loss_scale,
         )
 
         # Update statistics after training the DCM:
-        dcm_loss += dcm_train_summary["dcm_loss"]
-        correct_preds_i += dcm_train_summary["accuracy_i"][0]
+        epoch_sums.add("dcm_loss", dcm_train_summary["dcm_loss"])
+        epoch_sums.add("correct_preds_i", dcm_train_summary["accuracy_i"][0])
         n_preds_i += dcm_train_summary["accuracy_i"][1]
-        correct_preds_j += dcm_train_summary["accuracy_j"][0]
+        epoch_sums.add("correct_preds_j", dcm_train_summary["accuracy_j"][0])
         n_preds_j += dcm_train_summary["accuracy_j"][1]
 
+    # Read back the epoch statistics with a single sync
+    epoch_sums = epoch_sums.compute()
+    recon_loss_i = epoch_sums["recon_loss_i"]
+    recon_loss_j = epoch_sums["recon_loss_j"]
+    dcm_loss = epoch_sums["dcm_loss"]
+    ae_dcm_loss = epoch_sums["ae_dcm_loss"]
+    kl_loss = epoch_sums.get("kl_loss", 0)
+    latent_sm_loss = epoch_sums.get("latent_sm_loss", 0)
+    distance_loss = epoch_sums.get("distance_loss", 0)
+    paired_distance_samples = epoch_sums.get("paired_distance_samples", 0)
+    total_loss = epoch_sums["total_loss"]
+    correct_preds_i = epoch_sums["correct_preds_i"]
+    correct_preds_j = epoch_sums["correct_preds_j"]
+
     # Get average over batches for statistics
     recon_loss_i /= n_preds_i
     recon_loss_j /= n_preds_j
@@ -603,6 +863,28 @@ def process_epoch_two_domains(
     return epoch_statistics
 
 
+def get_monitored_value(
+    metric: str, epoch_statistics: dict, integration_metrics: dict = None
+) -> float:
+    if metric == "recon_loss":
+        return epoch_statistics["recon_loss_i"] + epoch_statistics["recon_loss_j"]
+    elif metric == "knn_accuracy":
+        # Mean over the evaluated numbers of neighbors
+        return float(np.mean(list(integration_metrics["knn_accs"].values())))
+    elif metric in ["latent_l1_distance", "foscttm"]:
+        return integration_metrics[metric]
+    elif metric in EARLY_STOPPING_METRIC_MODES:
+        if metric not in epoch_statistics:
+            raise RuntimeError(
+                "The {} is not computed for the given model configuration.".format(
+                    metric
+                )
+            )
+        return epoch_statistics[metric]
+    else:
+        raise NotImplementedError('Unknown monitor metric "{}"'.format(metric))
+
+
 def train_val_test_loop_two_domains(
     output_dir: str,
     domain_configs: List[DomainConfig],
@@ -621,6 +903,18 @@ def train_val_test_loop_two_domains(
     device: str = None,
     paired_mode: bool = False,
     latent_distance_loss: Module = None,
+    paired_data_loader_dict: dict = None,
+    share_encoder_forward: bool = False,
+    amp: str = None,
+    accumulation_steps: int = 1,
+    joint_optimizer: bool = False,
+    keep_last_checkpoints: int = None,
+    async_visualization: bool = False,
+    early_stopping_metric: str = "recon_loss",
+    early_stopping_smoothing: float = 0.0,
+    knn_backend: str = "exact",
+    knn_backend_kwargs: dict = None,
+    latent_cache_bytes: int = 2 ** 28,
 ) -> Tuple[dict, dict]:
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
@@ -629,31 +923,45 @@ def train_val_test_loop_two_domains(
     if not device:
         device = get_device()
 
+    # Mixed precision training, fp16 additionally requires scaling the loss to avoid underflowing gradients
+    grad_scaler = get_grad_scaler(amp=amp, device=device)
+
+    if accumulation_steps < 1:
+        raise RuntimeError(
+            "The number of accumulation steps must be positive, got {}.".format(
+                accumulation_steps
+            )
+        )
+
+    # The latents computed for the evaluation and the visualizations are cached on the device between consumers
+    configure_latent_cache(max_bytes=latent_cache_bytes)
+
     # Store start time of the training
     start_time = time.time()
 
-    # Initialize early stopping counter
-    es_counter = 0
+    # Initialize early stopping, the best model states with respect to the monitored validation metric are tracked
+    # even if early stopping is disabled
     if early_stopping < 0:
         early_stopping = num_epochs
+    if early_stopping_metric not in EARLY_STOPPING_METRIC_MODES:
+        raise NotImplementedError(
+            'Unknown monitor metric "{}", expected one of the following: {}'.format(
+                early_stopping_metric, ", ".join(EARLY_STOPPING_METRIC_MODES)
+            )
+        )
+    if early_stopping_metric in PAIRED_EARLY_STOPPING_METRICS and not paired_mode:
+        raise RuntimeError(
+            "Monitoring the {} requires paired data.".format(early_stopping_metric)
+        )
+    early_stopper = EarlyStopping(
+        patience=early_stopping,
+        mode=EARLY_STOPPING_METRIC_MODES[early_stopping_metric],
+        smoothing=early_stopping_smoothing,
+    )
 
     total_loss_dict = {"train": [], "val": []}
 
-    epoch_with_best_model = 0
-
-    # Reserve space to save best model configurations
     domain_names = [domain_configs[0].name, domain_configs[1].name]
-    best_model_i_weights = (
-        domain_configs[0].domain_model_config.model.cpu().state_dict()
-    )
-    best_model_j_weights = (
-        domain_configs[1].domain_model_config.model.cpu().state_dict()
-    )
-    best_model_configs = {
-        "model_i_weights": best_model_i_weights,
-        "model_j_weights": best_model_j_weights,
-    }
-
     for i in range(len(domain_names)):
         logging.debug("Model for domain {}:".format(domain_names[i]))
         logging.debug(domain_configs[i].domain_model_config.model)
@@ -681,18 +989,38 @@ def train_val_test_loop_two_domains(
         latent_structure_model_optimizer = None
         latent_structure_model_loss = None
 
-    if latent_dcm is not None:
-        best_latent_dcm_weights = latent_dcm.state_dict()
-        best_model_configs["dcm_weights"] = best_latent_dcm_weights
+    # Optionally update all trainable models of the AE step with a single joint optimizer, the discriminator keeps its
+    # own optimizer as it is updated in a separate step
+    ae_optimizer = None
+    if joint_optimizer:
+        ae_optimizers = [
+            domain_config.domain_model_config.optimizer
+            for domain_config in domain_configs
+            if domain_config.domain_model_config.trainable
+        ]
+        if use_latent_structure_model:
+            ae_optimizers.append(latent_structure_model_optimizer)
+        if len(ae_optimizers) > 0:
+            ae_optimizer = get_joint_optimizer(ae_optimizers)
+
+    # Optionally visualize the model performance at the checkpoints in a separate worker process, this is started
+    # before any background thread of the training such that it can be safely forked
+    visualization_worker = None
+    if async_visualization:
+        visualization_worker = AsyncVisualizationWorker(
+            domain_configs=domain_configs, dataset_types=["train", "val"]
+        )
 
-    if latent_structure_model is not None:
-        best_latent_structure_model_weights = latent_structure_model.state_dict()
-        best_model_configs[
-            "latent_structure_model_weights"
-        ] = best_latent_structure_model_weights
+    # Checkpoints are written by a background thread, optionally only the last keep_last_checkpoints are kept
+    checkpoint_writer = CheckpointWriter(keep_last=keep_last_checkpoints)
 
-    # Initialize current best loss
-    best_total_loss = np.infty
+    # Models whose best states are restored after the training
+    selected_models = {
+        "model_i": domain_configs[0].domain_model_config.model,
+        "model_j": domain_configs[1].domain_model_config.model,
+        "dcm": latent_dcm,
+        "latent_structure_model": latent_structure_model,
+    }
 
     # Iterate over the epochs
     for i in range(num_epochs):
@@ -702,10 +1030,10 @@ def train_val_test_loop_two_domains(
         logging.debug("---" * 20)
 
         # Check if early stopping is triggered
-        if es_counter > early_stopping:
+        if early_stopper.should_stop:
             logging.debug(
                 "Training was stopped early due to no improvement of the validation"
-                " loss for {} epochs.".format(early_stopping)
+                " {} for {} epochs.".format(early_stopping_metric, early_stopping)
             )
             break
 
@@ -730,6 +1058,12 @@ def train_val_test_loop_two_domains(
                 phase=phase,
                 device=device,
                 latent_distance_loss=latent_distance_loss,
+                paired_data_loader_dict=paired_data_loader_dict,
+                share_encoder_forward=share_encoder_forward,
+                amp=amp,
+                grad_scaler=grad_scaler,
+                accumulation_steps=accumulation_steps,
+                ae_optimizer=ae_optimizer,
             )
 
             logging.debug(
@@ -787,13 +1121,20 @@ def train_val_test_loop_two_domains(
                     )
                 )
 
+            metrics = None
             if phase == "val" and paired_mode:
                 metrics = evaluate_latent_integration(
                     model_i=domain_configs[0].domain_model_config.model,
                     model_j=domain_configs[1].domain_model_config.model,
                     data_loader_i=domain_configs[0].data_loader_dict["val"],
                     data_loader_j=domain_configs[1].data_loader_dict["val"],
+                    data_key_i=domain_configs[0].data_key,
+                    data_key_j=domain_configs[1].data_key,
                     device=device,
+                    label_key_i=domain_configs[0].label_key,
+                    label_key_j=domain_configs[1].label_key,
+                    knn_backend=knn_backend,
+                    knn_backend_kwargs=knn_backend_kwargs,
                 )
                 logging.debug(
                     "Latent l1 distance of paired data normalized by the mean l1"
@@ -805,6 +1146,15 @@ def train_val_test_loop_two_domains(
                     logging.debug(
                         "{}-NN accuracy for the paired data: {:.8f}".format(k, v)
                     )
+                logging.debug(
+                    "FOSCTTM of the paired data: {:.8f}".format(metrics["foscttm"])
+                )
+                if "knn_recall" in metrics:
+                    logging.debug(
+                        "Recall of the approximate {}-NN search: {:.8f}".format(
+                            knn_backend, metrics["knn_recall"]
+                        )
+                    )
 
             logging.debug("***" * 20)
 
@@ -815,6 +1165,21 @@ def train_val_test_loop_two_domains(
             total_loss_dict[phase].append(epoch_total_loss)
 
             if phase == "val":
+                # Keep the model states in memory if they give the best value of the monitored metric
+                monitored_value = get_monitored_value(
+                    metric=early_stopping_metric,
+                    epoch_statistics=epoch_statistics,
+                    integration_metrics=metrics,
+                )
+                if early_stopper.step(
+                    value=monitored_value, epoch=i, modules=selected_models
+                ):
+                    logging.debug(
+                        "New best validation {}: {:.8f}".format(
+                            early_stopping_metric, early_stopper.best_value
+                        )
+                    )
+
                 if i % save_freq == 0:
 
                     domain_model_configs = [
@@ -831,41 +1196,39 @@ def train_val_test_loop_two_domains(
 
                     # Save model states regularly
                     checkpoint_dir = "{}/epoch_{}".format(output_dir, i)
-                    visualize_model_performance(
-                        output_dir=checkpoint_dir,
-                        domain_configs=domain_configs,
-                        dataset_types=["train", "val"],
-                        device=device,
-                    )
-
-                    vae_i_weights = (
-                        domain_configs[0].domain_model_config.model.cpu().state_dict()
-                    )
-                    vae_j_weights = (
-                        domain_configs[1].domain_model_config.model.cpu().state_dict()
-                    )
-                    torch.save(
-                        vae_i_weights,
-                        "{}/model_{}.pth".format(checkpoint_dir, domain_names[0]),
-                    )
-                    torch.save(
-                        vae_j_weights,
-                        "{}/model_{}.pth".format(checkpoint_dir, domain_names[1]),
-                    )
+                    if visualization_worker is not None:
+                        visualization_worker.submit(
+                            output_dir=checkpoint_dir, domain_configs=domain_configs
+                        )
+                    else:
+                        visualize_model_performance(
+                            output_dir=checkpoint_dir,
+                            domain_configs=domain_configs,
+                            dataset_types=["train", "val"],
+                            device=device,
+                        )
 
+                    # The states are snapshot on the device and written to disk in the background
+                    model_i = domain_configs[0].domain_model_config.model
+                    model_j = domain_configs[1].domain_model_config.model
+                    state_dicts = {
+                        "model_{}.pth".format(domain_names[0]): model_i.state_dict(),
+                        "model_{}.pth".format(domain_names[1]): model_j.state_dict(),
+                    }
                     if latent_dcm is not None:
-                        latent_dcm_weights = latent_dcm.cpu().state_dict()
-                        torch.save(
-                            latent_dcm_weights, "{}/dcm.pth".format(checkpoint_dir)
-                        )
+                        state_dicts["dcm.pth"] = latent_dcm.state_dict()
                     if latent_structure_model is not None:
-                        latent_structure_model_weights = (
-                            latent_structure_model.cpu().state_dict()
-                        )
-                        torch.save(
-                            latent_structure_model_weights,
-                            "{}/latent_structure_model.pth".format(checkpoint_dir),
-                        )
+                        state_dicts[
+                            "latent_structure_model.pth"
+                        ] = latent_structure_model.state_dict()
+                    checkpoint_writer.save(
+                        state_dicts=state_dicts, checkpoint_dir=checkpoint_dir
+                    )
+
+    # Wait for the pending checkpoints to be written and visualized
+    checkpoint_writer.close()
+    if visualization_worker is not None:
+        visualization_worker.close()
 
     # Training complete
     time_elapsed = time.time() - start_time
@@ -877,22 +1240,9 @@ def train_val_test_loop_two_domains(
         )
     )
 
-    # Load best models
-    # logging.debug(
-    #     "Load best model configurations found in epoch {}.".format(
-    #         epoch_with_best_model
-    #     )
-    # )
-    # Todo removed loading of best model - because for adversarial training the total loss is too unstable for
-    # this model selection procedure to work.
-
-    # domain_configs[0].domain_model_config.model.load_state_dict(best_model_i_weights)
-    # domain_configs[1].domain_model_config.model.load_state_dict(best_model_j_weights)
-    #
-    # if latent_dcm is not None:
-    #     latent_dcm.load_state_dict(best_latent_dcm_weights)
-    # if latent_structure_model is not None:
-    #     latent_structure_model.load_state_dict(best_latent_structure_model_weights)
+    # Load best models, the total loss is too unstable in the adversarial training for the model selection such that
+    # by default the reconstruction loss is monitored
+    early_stopper.restore(selected_models)
 
     if "test" in domain_configs[0].data_loader_dict:
         epoch_statistics = process_epoch_two_domains(
@@ -912,6 +1262,12 @@ def train_val_test_loop_two_domains(
             phase="test",
             device=device,
             latent_distance_loss=latent_distance_loss,
+            paired_data_loader_dict=paired_data_loader_dict,
+            share_encoder_forward=share_encoder_forward,
+            amp=amp,
+            grad_scaler=grad_scaler,
+            accumulation_steps=accumulation_steps,
+            ae_optimizer=ae_optimizer,
         )
 
         logging.debug("###" * 20)
@@ -973,7 +1329,13 @@ def train_val_test_loop_two_domains(
                 model_j=domain_configs[1].domain_model_config.model,
                 data_loader_i=domain_configs[0].data_loader_dict["test"],
                 data_loader_j=domain_configs[1].data_loader_dict["test"],
+                data_key_i=domain_configs[0].data_key,
+                data_key_j=domain_configs[1].data_key,
                 device=device,
+                label_key_i=domain_configs[0].label_key,
+                label_key_j=domain_configs[1].label_key,
+                knn_backend=knn_backend,
+                knn_backend_kwargs=knn_backend_kwargs,
             )
             logging.debug(
                 "Latent l1 distance of paired data normalized by the mean l1 distance"
@@ -981,6 +1343,15 @@ def train_val_test_loop_two_domains(
             )
             for k, v in metrics["knn_accs"].items():
                 logging.debug("{}-NN accuracy for the paired data: {:.8f}".format(k, v))
+            logging.debug(
+                "FOSCTTM of the paired data: {:.8f}".format(metrics["foscttm"])
+            )
+            if "knn_recall" in metrics:
+                logging.debug(
+                    "Recall of the approximate {}-NN search: {:.8f}".format(
+                        knn_backend, metrics["knn_recall"]
+                    )
+                )
 
         logging.debug("***" * 20)
 
@@ -1024,6 +1395,7 @@ def train_val_test_loop_two_domains(
         dataset_types=["train", "val", "test"],
         device=device,
     )
+    clear_latent_cache()
 
     return trained_models, total_loss_dict
 
@@ -1040,6 +1412,8 @@ def train_autoencoder(
     use_latent_structure_model: bool = True,
     device: str = "cuda:0",
     model_base_type: str = "ae",
+    amp: str = None,
+    grad_scaler: GradScaler = None,
 ) -> dict:
     # Get all parameters of the configuration for domain i
     model = domain_model_config.model
@@ -1049,127 +1423,122 @@ def train_autoencoder(
     recon_loss_fct = domain_model_config.recon_loss_function
     train = domain_model_config.trainable
 
-    scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, verbose=True)
-
-    # Set V/AE model to train if defined in respective configuration
-    model.to(device)
-
+    # Set V/AE model to train if defined in respective configuration, the models are placed on the device once per
+    # phase by the caller
+    set_module_mode(model, train=phase == "train")
     if phase == "train":
-        model.train()
         optimizer.zero_grad()
-    else:
-        model.eval()
 
     if use_latent_structure_model:
         assert latent_structure_model is not None
-        if phase == "train":
-            latent_structure_model.train()
-        else:
-            latent_structure_model.eval()
-        latent_structure_model.to(device)
+        set_module_mode(latent_structure_model, train=phase == "train")
         latent_structure_model_optimizer.zero_grad()
 
-    # Forward pass of the VAE
-    inputs = Variable(inputs).to(device)
-    labels = Variable(labels).to(device)
+    with get_autocast_context(amp=amp, device=device):
+        # Forward pass of the VAE
+        inputs = Variable(inputs).to(device, non_blocking=True)
+        labels = Variable(labels).to(device, non_blocking=True)
 
-    outputs = model(inputs)
-    recons = outputs["recons"]
-    latents = outputs["latents"]
+        outputs = model(inputs)
+        recons = outputs["recons"]
+        latents = outputs["latents"]
 
-    if model_base_type == "vae":
-        mu = outputs["mu"]
+        if model_base_type == "vae":
+            mu = outputs["mu"]
 
-        logvar = outputs["logvar"]
+            logvar = outputs["logvar"]
 
-        loss_dict = model.loss_function(
-            inputs=inputs, recons=recons, mu=mu, logvar=logvar
-        )
+            loss_dict = model.loss_function(
+                inputs=inputs, recons=recons, mu=mu, logvar=logvar
+            )
 
-        recon_loss = loss_dict["recon_loss"]
-        kld_loss = loss_dict["kld_loss"]
+            recon_loss = loss_dict["recon_loss"]
+            kld_loss = loss_dict["kld_loss"]
 
-        kl_loss = kld_loss
-        total_loss = recon_loss * alpha + kl_loss * lamb
-    elif model_base_type == "gmvae":
-        logits = outputs["logits"]
-        probs = outputs["probs"]
-        component_labels = outputs["component_labels"]
-        mu = outputs["mu"]
-        logvar = outputs["logvar"]
-        mu_component_prior = outputs["mu_component_prior"]
-        logvar_component_prior = outputs["logvar_component_prior"]
-
-        loss_dict = model.loss_function(
-            inputs=inputs,
-            recons=recons,
-            mu=mu,
-            logvar=logvar,
-            mu_prior=mu_component_prior,
-            logvar_prior=logvar_component_prior,
-            y_probs=probs,
-            y_logits=logits,
-            y_true=labels,
-        )
+            kl_loss = kld_loss
+            total_loss = recon_loss * alpha + kl_loss * lamb
+        elif model_base_type == "gmvae":
+            logits = outputs["logits"]
+            probs = outputs["probs"]
+            component_labels = outputs["component_labels"]
+            mu = outputs["mu"]
+            logvar = outputs["logvar"]
+            mu_component_prior = outputs["mu_component_prior"]
+            logvar_component_prior = outputs["logvar_component_prior"]
+
+            loss_dict = model.loss_function(
+                inputs=inputs,
+                recons=recons,
+                mu=mu,
+                logvar=logvar,
+                mu_prior=mu_component_prior,
+                logvar_prior=logvar_component_prior,
+                y_probs=probs,
+                y_logits=logits,
+                y_true=labels,
+            )
 
-        recon_loss = loss_dict["recon_loss"]
-        kld_loss = loss_dict["kld_loss"]
-        component_prior_loss = loss_dict["component_prior_loss"]
-        component_supervision_loss = loss_dict["component_supervision_loss"]
+            recon_loss = loss_dict["recon_loss"]
+            kld_loss = loss_dict["kld_loss"]
+            component_prior_loss = loss_dict["component_prior_loss"]
+            component_supervision_loss = loss_dict["component_supervision_loss"]
 
-        kl_loss = kld_loss
+            kl_loss = kld_loss
 
-        total_loss = recon_loss * alpha + lamb * kl_loss
-        if component_prior_loss is not None:
-            total_loss += component_prior_loss * gamma
-        elif component_supervision_loss is not None:
-            total_loss += component_supervision_loss * gamma
+            total_loss = recon_loss * alpha + lamb * kl_loss
+            if component_prior_loss is not None:
+                total_loss += component_prior_loss * gamma
+            elif component_supervision_loss is not None:
+                total_loss += component_supervision_loss * gamma
 
-    elif model_base_type == "ae":
-        recon_loss = model.loss_function(inputs=inputs, recons=recons)["recon_loss"]
-        total_loss = recon_loss
-    else:
-        raise RuntimeError("Unknown model type: {}".format(model_base_type))
+        elif model_base_type == "ae":
+            recon_loss = model.loss_function(inputs=inputs, recons=recons)["recon_loss"]
+            total_loss = recon_loss
+        else:
+            raise RuntimeError("Unknown model type: {}".format(model_base_type))
 
-    # Forward pass latent structure model if it is supposed to be trained and used to assess the integration of the learned
-    # latent spaces
-    if use_latent_structure_model:
-        latent_structure_model_output = latent_structure_model(latents)
+        # Forward pass latent structure model if it is supposed to be trained and used to assess the integration of the learned
+        # latent spaces
+        if use_latent_structure_model:
+            latent_structure_model_output = latent_structure_model(latents)
 
-    # # Add loss of latent structure model if this is trained
-    if use_latent_structure_model:
-        latent_sm_loss = latent_structure_model_loss(
-            latent_structure_model_output, labels.view(-1).long()
-        )
-        total_loss += latent_sm_loss * gamma
+        # # Add loss of latent structure model if this is trained
+        if use_latent_structure_model:
+            latent_sm_loss = latent_structure_model_loss(
+                latent_structure_model_output, labels.view(-1).long()
+            )
+            total_loss += latent_sm_loss * gamma
 
     # Backpropagate loss and update parameters if we are in the training phase
     if phase == "train":
-        total_loss.backward()
+        optimizers = []
         if train:
-            optimizer.step()
+            optimizers.append(optimizer)
             model.updated = True
         if use_latent_structure_model:
-            latent_structure_model_optimizer.step()
-
-        scheduler.step(total_loss)
+            optimizers.append(latent_structure_model_optimizer)
+        backward_and_step(
+            loss=total_loss, optimizers=optimizers, grad_scaler=grad_scaler
+        )
 
-    # Get summary statistics
+    # Get summary statistics, these are kept as detached tensors on the device and accumulated by the caller
     batch_size = inputs.size(0)
-    total_loss_item = recon_loss.item() * batch_size
+    total_loss_item = recon_loss.detach() * batch_size
 
-    batch_statistics = {"recon_loss": recon_loss.item() * batch_size}
+    batch_statistics = {"recon_loss": recon_loss.detach() * batch_size}
 
     if model_base_type == "vae":
-        batch_statistics["kl_loss"] = kl_loss.item()
-        total_loss_item += kl_loss.item()
+        batch_statistics["kl_loss"] = kl_loss.detach()
+        total_loss_item += kl_loss.detach()
 
     if use_latent_structure_model:
         batch_statistics["latent_structure_model_loss"] = (
-            latent_sm_loss.item() * batch_size
+            latent_sm_loss.detach() * batch_size
+        )
+        batch_statistics["accuracy"] = correct_predictions(
+            latent_structure_model_output, labels
         )
-        batch_statistics["accuracy"] = accuracy(latent_structure_model_output, labels)
-        total_loss_item += latent_sm_loss.item() * batch_size
+        total_loss_item += latent_sm_loss.detach() * batch_size
 
     batch_statistics["total_loss"] = total_loss_item
 
@@ -1187,29 +1556,36 @@ def process_epoch_single_domain(
     use_latent_structure_model: bool = True,
     phase: str = "train",
     device: str = "cuda:0",
+    amp: str = None,
+    grad_scaler: GradScaler = None,
 ) -> dict:
     # Get domain configurations for the domain
     domain_model_config = domain_config.domain_model_config
     data_loader_dict = domain_config.data_loader_dict
     data_loader = data_loader_dict[phase]
-    data_key = domain_config.data_key
     label_key = domain_config.label_key
 
-    # Initialize epoch statistics
-    recon_loss = 0
-    latent_sm_loss = 0
-    kl_loss = 0
-    total_loss = 0
-
-    correct_preds = 0
+    # Initialize epoch statistics, the losses are summed on the device and read back once at the end of the epoch
+    epoch_sums = MetricAccumulator()
     n_preds = 0
 
     model_base_type = domain_model_config.model.model_base_type.lower()
 
+    # Place all models on the device once per phase instead of once per batch
+    place_modules(
+        [
+            domain_model_config.model,
+            latent_structure_model if use_latent_structure_model else None,
+        ],
+        device=device,
+    )
+
     # Iterate over batches
     for index, samples in enumerate(data_loader):
         # Set model_configs
-        domain_model_config.inputs = samples[data_key]
+        domain_model_config.inputs = get_batch_inputs(
+            domain_config=domain_config, samples=samples, phase=phase, device=device
+        )
         domain_model_config.labels = samples[label_key]
 
         batch_statistics = train_autoencoder(
@@ -1224,16 +1600,28 @@ def process_epoch_single_domain(
             device=device,
             use_latent_structure_model=use_latent_structure_model,
             model_base_type=model_base_type,
+            amp=amp,
+            grad_scaler=grad_scaler,
         )
 
-        recon_loss += batch_statistics["recon_loss"]
+        epoch_sums.add("recon_loss", batch_statistics["recon_loss"])
         if use_latent_structure_model:
-            latent_sm_loss += batch_statistics["latent_structure_model_loss"]
-            correct_preds += batch_statistics["accuracy"][0]
+            epoch_sums.add(
+                "latent_sm_loss", batch_statistics["latent_structure_model_loss"]
+            )
+            epoch_sums.add("correct_preds", batch_statistics["accuracy"][0])
             n_preds += batch_statistics["accuracy"][1]
         if model_base_type == "vae":
-            kl_loss += batch_statistics["kl_loss"]
-        total_loss += batch_statistics["total_loss"]
+            epoch_sums.add("kl_loss", batch_statistics["kl_loss"])
+        epoch_sums.add("total_loss", batch_statistics["total_loss"])
+
+    # Read back the epoch statistics with a single sync
+    epoch_sums = epoch_sums.compute()
+    recon_loss = epoch_sums["recon_loss"]
+    latent_sm_loss = epoch_sums.get("latent_sm_loss", 0)
+    correct_preds = epoch_sums.get("correct_preds", 0)
+    kl_loss = epoch_sums.get("kl_loss", 0)
+    total_loss = epoch_sums["total_loss"]
 
     # Get average over batches for statistics
     recon_loss /= len(data_loader.dataset)
@@ -1271,6 +1659,7 @@ def train_val_test_loop_single_domain(
     save_freq: int = 10,
     early_stopping: int = 20,
     device: str = None,
+    amp: str = None,
 ) -> Tuple[dict, dict]:
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
@@ -1279,6 +1668,9 @@ def train_val_test_loop_single_domain(
     if not device:
         device = get_device()
 
+    # Mixed precision training, fp16 additionally requires scaling the loss to avoid underflowing gradients
+    grad_scaler = get_grad_scaler(amp=amp, device=device)
+
     # Store start time of the training
     start_time = time.time()
 
@@ -1289,8 +1681,10 @@ def train_val_test_loop_single_domain(
 
     total_loss_dict = {"train": [], "val": []}
 
-    # Reserve space for best model weights
-    best_model_weights = domain_config.domain_model_config.model.cpu().state_dict()
+    # Reserve space for best model weights, the snapshots are kept on the device the model lives on
+    best_model_weights = CheckpointWriter.get_snapshot(
+        domain_config.domain_model_config.model.state_dict()
+    )
 
     if use_latent_structure_model:
         latent_structure_model = latent_structure_model_config["model"]
@@ -1303,7 +1697,9 @@ def train_val_test_loop_single_domain(
 
     # Reserve space for best latent latent_structure_model weights
     if latent_structure_model is not None:
-        best_latent_structure_model_weights = latent_structure_model.cpu().state_dict()
+        best_latent_structure_model_weights = CheckpointWriter.get_snapshot(
+            latent_structure_model.state_dict()
+        )
     else:
         best_latent_structure_model_weights = None
 
@@ -1314,6 +1710,10 @@ def train_val_test_loop_single_domain(
 
     best_total_loss = np.infty
 
+    # The best model states are written to disk by a background thread such that training is not blocked by the
+    # transfer to the cpu
+    checkpoint_writer = CheckpointWriter()
+
     # Iterate over the epochs
     for i in range(num_epochs):
         logging.debug("---" * 20)
@@ -1342,6 +1742,8 @@ def train_val_test_loop_single_domain(
                 use_latent_structure_model=use_latent_structure_model,
                 phase=phase,
                 device=device,
+                amp=amp,
+                grad_scaler=grad_scaler,
             )
 
             logging.debug(
@@ -1390,26 +1792,28 @@ def train_val_test_loop_single_domain(
                     es_counter = 0
                     best_total_loss = epoch_total_loss
 
-                    best_model_weights = copy.deepcopy(
-                        domain_config.domain_model_config.model.cpu().state_dict()
+                    best_model_weights = CheckpointWriter.get_snapshot(
+                        domain_config.domain_model_config.model.state_dict()
                     )
                     best_model_configs["best_model_weights"] = best_model_weights
-
-                    torch.save(
-                        best_model_weights, "{}/best_model.pth".format(output_dir),
-                    )
+                    best_state_dicts = {"best_model.pth": best_model_weights}
 
                     if latent_structure_model is not None:
-                        best_latent_structure_model_weights = copy.deepcopy(
-                            latent_structure_model.cpu().state_dict()
+                        best_latent_structure_model_weights = (
+                            CheckpointWriter.get_snapshot(
+                                latent_structure_model.state_dict()
+                            )
                         )
                         best_model_configs[
                             "latent_structure_model_weights"
                         ] = best_latent_structure_model_weights
-                        torch.save(
-                            best_latent_structure_model_weights,
-                            "{}/best_latent_structure_model.pth".format(output_dir),
-                        )
+                        best_state_dicts[
+                            "best_latent_structure_model.pth"
+                        ] = best_latent_structure_model_weights
+
+                    checkpoint_writer.save(
+                        state_dicts=best_state_dicts, checkpoint_dir=output_dir
+                    )
                 else:
                     es_counter += 1
 
@@ -1443,6 +1847,9 @@ def train_val_test_loop_single_domain(
                             "{}/latent_structure_model.pth".format(checkpoint_dir),
                         )
 
+    # Wait for the last best model states to be written
+    checkpoint_writer.close()
+
     # Training complete
     time_elapsed = time.time() - start_time
 
@@ -1469,6 +1876,8 @@ def train_val_test_loop_single_domain(
             use_latent_structure_model=use_latent_structure_model,
             phase="test",
             device=device,
+            amp=amp,
+            grad_scaler=grad_scaler,
         )
 
         logging.debug("TEST LOSS STATISTICS")
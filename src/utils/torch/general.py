@@ -1,3 +1,5 @@
+import contextlib
+
 import torch
 from torchvision.transforms import (
     Compose,
@@ -8,6 +10,8 @@ from torchvision.transforms import (
 )
 from torch.nn import Module, L1Loss, MSELoss, Sigmoid, Softmax, ReLU
 
+from src.helper.custom_transforms import RandomBatchFlipRotation
+
 
 def get_device():
     device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
@@ -41,6 +45,70 @@ def get_transformation_dict_for_train_val_test():
     return transformation_dict
 
 
+def get_batch_transformation_dict_for_train_val_test(
+    batch_augmentation_config: dict = None,
+) -> dict:
+    # Tensor-native counterpart to the sample-wise pipeline above, applied to collated batches on the training device
+    if batch_augmentation_config is None:
+        train_transforms = None
+    else:
+        train_transforms = RandomBatchFlipRotation(**batch_augmentation_config)
+    transformation_dict = {
+        "train": train_transforms,
+        "val": None,
+        "test": None,
+    }
+    return transformation_dict
+
+
+def get_autocast_context(amp: str = None, device: str = "cuda:0"):
+    if amp is None:
+        return contextlib.nullcontext()
+    dtypes = {"fp16": torch.float16, "bf16": torch.bfloat16}
+    if amp not in dtypes:
+        raise NotImplementedError(
+            'Unknown amp mode "{}", expected one of the following: fp16, bf16'.format(
+                amp
+            )
+        )
+    device_type = torch.device(device).type
+    # Older torch versions only provide autocast for cuda devices in fp16
+    if hasattr(torch, "autocast"):
+        return torch.autocast(device_type=device_type, dtype=dtypes[amp])
+    elif device_type == "cuda" and amp == "fp16":
+        return torch.cuda.amp.autocast()
+    else:
+        raise RuntimeError(
+            "Mixed precision mode {} on {} is not supported by torch {}.".format(
+                amp, device_type, torch.__version__
+            )
+        )
+
+
+def get_grad_scaler(amp: str = None, device: str = "cuda:0"):
+    # bf16 has the dynamic range of fp32 and does not require loss scaling
+    if amp != "fp16":
+        return None
+    device_type = torch.device(device).type
+    if hasattr(torch, "amp") and hasattr(torch.amp, "GradScaler"):
+        return torch.amp.GradScaler(device_type)
+    elif device_type == "cuda":
+        return torch.cuda.amp.GradScaler()
+    else:
+        raise RuntimeError(
+            "Gradient scaling on {} is not supported by torch {}.".format(
+                device_type, torch.__version__
+            )
+        )
+
+
+def get_inference_context():
+    # inference_mode additionally skips the version counting of no_grad, it is only available from torch 1.9 on
+    if hasattr(torch, "inference_mode"):
+        return torch.inference_mode()
+    return torch.no_grad()
+
+
 def get_latent_distance_loss(loss_type: str = "mae") -> Module:
     if loss_type == "mae":
         latent_distance_loss = L1Loss()
@@ -1,3 +1,6 @@
+import logging
+from typing import List
+
 import torch
 from torch.nn import (
     Module,
@@ -19,6 +22,7 @@ from torch.optim.adam import Adam
 from torch.optim.optimizer import Optimizer
 from torch.optim.rmsprop import RMSprop
 
+from src.helper.compiled_module import CompiledModule
 from src.helper.models import DomainConfig
 from src.models.ae import VanillaAE, TwoLatentSpaceAE
 from src.models.latent_models import (
@@ -31,6 +35,18 @@ from src.models.vae import VanillaConvVAE, VanillaVAE
 from src.utils.torch.general import get_device
 
 
+def compile_model(model: Module) -> Module:
+    if not hasattr(torch, "compile"):
+        logging.debug(
+            "torch.compile is not available in torch {}, the model is run"
+            " eagerly.".format(torch.__version__)
+        )
+        return model
+
+    # Only the forward is compiled, the wrapper keeps the original model for its attributes and its state dict
+    return CompiledModule(model)
+
+
 def add_model_to_optimizer(optimizer: Optimizer, model: Module):
     optimizer.add_param_group(model.parameters())
 
@@ -46,6 +62,48 @@ def get_optimizer_for_model(optimizer_dict: dict, model: Module) -> Optimizer:
     return optimizer
 
 
+def get_joint_optimizer(optimizers: List[Optimizer]) -> Optimizer:
+    optimizer_types = set([type(optimizer) for optimizer in optimizers])
+    if len(optimizer_types) != 1:
+        raise RuntimeError(
+            "Joint optimization requires optimizers of the same type, got {}.".format(
+                [optimizer_type.__name__ for optimizer_type in optimizer_types]
+            )
+        )
+    optimizer_type = optimizer_types.pop()
+
+    # Parameter groups with the same hyperparameters are merged such that their parameters are updated in a single
+    # (foreach) step, groups that differ keep their own hyperparameters
+    param_groups = []
+    for optimizer in optimizers:
+        for group in optimizer.param_groups:
+            hyperparameters = {k: v for k, v in group.items() if k != "params"}
+            for param_group in param_groups:
+                if param_group["hyperparameters"] == hyperparameters:
+                    param_group["params"].extend(group["params"])
+                    break
+            else:
+                param_groups.append(
+                    {
+                        "params": list(group["params"]),
+                        "hyperparameters": hyperparameters,
+                    }
+                )
+    param_groups = [
+        dict(param_group["hyperparameters"], params=param_group["params"])
+        for param_group in param_groups
+    ]
+    joint_optimizer = optimizer_type(param_groups, **optimizers[0].defaults)
+
+    # Share the per-parameter states (e.g. the Adam moments) with the original optimizers such that these are kept
+    # up-to-date by the joint optimizer and vice versa
+    for optimizer in optimizers:
+        for group in optimizer.param_groups:
+            for parameter in group["params"]:
+                joint_optimizer.state[parameter] = optimizer.state[parameter]
+    return joint_optimizer
+
+
 def get_domain_configuration(
     name: str,
     model_dict: dict,
@@ -55,9 +113,11 @@ def get_domain_configuration(
     data_key: str,
     label_key: str,
     train_model: bool = True,
+    batch_transform_dict: dict = None,
 ) -> DomainConfig:
 
     model_type = model_dict.pop("type")
+    compile_forward = model_dict.pop("compile", False)
     if model_type == "VanillaConvVAE":
         model = VanillaConvVAE(**model_dict)
     elif model_type == "VanillaVAE":
@@ -73,6 +133,9 @@ def get_domain_configuration(
     else:
         raise NotImplementedError('Unknown model type "{}"'.format(model_type))
 
+    if compile_forward:
+        model = compile_model(model)
+
     optimizer = get_optimizer_for_model(optimizer_dict=optimizer_dict, model=model)
 
     recon_loss_fct_type = recon_loss_fct_dict.pop("type")
@@ -98,6 +161,7 @@ def get_domain_configuration(
         data_key=data_key,
         label_key=label_key,
         train_model=train_model,
+        batch_transform_dict=batch_transform_dict,
     )
 
     return domain_config
@@ -111,6 +175,7 @@ def get_latent_model_configuration(
         device = get_device()
 
     model_type = model_dict.pop("type")
+    compile_forward = model_dict.pop("compile", False)
     if model_type == "LatentDiscriminator":
         model = LatentDiscriminator(**model_dict)
     elif model_type == "LatentClassifier":
@@ -120,6 +185,9 @@ def get_latent_model_configuration(
     else:
         raise NotImplementedError('Unknown model type "{}"'.format(model_type))
 
+    if compile_forward:
+        model = compile_model(model)
+
     optimizer = get_optimizer_for_model(optimizer_dict=optimizer_dict, model=model)
 
     if model_type != "LatentRegressor":